@@ -0,0 +1,33 @@
+"""
+Compare SSDB.generate_cmd with encode_cmd on multi_set batches.
+
+usage: python benchmarks/bench_encode.py
+"""
+
+import timeit
+
+from ssdb.client import SSDB, encode_cmd
+
+
+def make_params(count, value_size):
+    params = []
+    for i in xrange(count):
+        params.extend(['key_%d' % i, 'v' * value_size])
+    return params
+
+
+def main():
+    client = SSDB()
+    cases = [(1000, 16), (1000, 1024), (100, 1024 * 100), (10, 1024 * 1024)]
+    print '%-22s %14s %14s %8s' % ('multi_set batch', 'generate_cmd', 'encode_cmd', 'speedup')
+    for count, value_size in cases:
+        params = make_params(count, value_size)
+        number = max(1, 2000000 / (count * value_size))
+        old = min(timeit.repeat(lambda: client.generate_cmd(['multi_set'] + params), number=number, repeat=3))
+        new = min(timeit.repeat(lambda: encode_cmd('multi_set', params), number=number, repeat=3))
+        print '%-22s %12.3fms %12.3fms %7.1fx' % ('%d x %dB' % (count, value_size),
+                                                  old * 1000 / number, new * 1000 / number, old / new)
+
+
+if __name__ == '__main__':
+    main()
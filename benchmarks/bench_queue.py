@@ -0,0 +1,47 @@
+"""
+Measure queue throughput of single qpush_back/qpop_front calls against QueueProducer/QueueConsumer batches.
+Needs a ssdb server on 127.0.0.1:8888.
+
+usage: python benchmarks/bench_queue.py
+"""
+
+import time
+
+from ssdb.client import SSDB
+
+
+def main():
+    client = SSDB('127.0.0.1', 8888, max_connections=2)
+    name = 'bench_queue'
+    client.qclear(name)
+    print '%-28s %14s %14s' % ('', 'push items/s', 'pop items/s')
+
+    count = 2000
+    start = time.time()
+    for i in xrange(count):
+        client.qpush_back(name, ['item_%d' % i])
+    push = count / (time.time() - start)
+    start = time.time()
+    for i in xrange(count):
+        client.qpop_front(name)
+    pop = count / (time.time() - start)
+    print '%-28s %14d %14d' % ('one item per request', push, pop)
+
+    count = 200000
+    for batch_size in (100, 1000):
+        start = time.time()
+        with client.queue_producer(name, batch_size=batch_size) as producer:
+            for i in xrange(count):
+                producer.put('item_%d' % i)
+        push = count / (time.time() - start)
+        start = time.time()
+        with client.queue_consumer(name, batch_size=batch_size) as consumer:
+            for item in consumer:
+                pass
+        pop = count / (time.time() - start)
+        print '%-28s %14d %14d' % ('batches of %d' % batch_size, push, pop)
+    client.qclear(name)
+
+
+if __name__ == '__main__':
+    main()
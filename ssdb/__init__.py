@@ -1,15 +1,41 @@
 from ssdb.client import (
     SSDB,
     SSDBResponse,
+    ScanResult,
+    RawSSDB,
+    Pipeline,
+    QueueConsumer,
+    QueueProducer,
+    RequestCoalescer,
+    MultiplexedConnection,
+    ReadCache,
+    ReplicaRouter,
+    RequestHedger,
     ConnectionError,
+    ResponseError,
     Connection,
-    ConnectionPool
+    ConnectionPool,
+    ResponseParser,
+    register_command,
+    unregister_command
     )
+from ssdb.disk_cache import DiskCache
+from ssdb.bloom import BloomFilter
+from ssdb.sharding import ShardedSSDB, HashRing
+from ssdb.bulk import BulkLoader
+from ssdb.metrics import ClientMetrics
+from ssdb.codec import RawCodec, JSONCodec, PickleCodec, StructCodec, CompressedCodec
+from ssdb.snapshot import dump, restore
 
 __version__ = '1.0.0'
 VERSION = tuple(map(int, __version__.split('.')))
 
 __all__ = [
-    'SSDB', 'SSDBResponse', 'ConnectionPool', 'Connection',
-    'ConnectionError'
+    'SSDB', 'SSDBResponse', 'ScanResult', 'RawSSDB', 'Pipeline',
+    'QueueConsumer', 'QueueProducer', 'RequestCoalescer', 'MultiplexedConnection',
+    'ReadCache', 'ReplicaRouter', 'RequestHedger', 'DiskCache', 'BloomFilter',
+    'ShardedSSDB', 'HashRing', 'BulkLoader', 'dump', 'restore',
+    'RawCodec', 'JSONCodec', 'PickleCodec', 'StructCodec', 'CompressedCodec',
+    'ClientMetrics', 'ConnectionPool', 'Connection',
+    'ConnectionError', 'ResponseError', 'ResponseParser', 'register_command', 'unregister_command'
 ]
@@ -0,0 +1,160 @@
+# encoding=utf-8
+"""
+Bloom filter of existing keys,answering reads of missing keys locally
+"""
+
+import hashlib
+import math
+import struct
+import threading
+
+from ssdb.client import cache_invalidations, encode_value
+
+_HEADER = struct.Struct('<8sIQIQ')
+_MAGIC = 'SSDBBLMF'
+_VERSION = 1
+
+
+def _string(item):
+    """
+    An int,unicode,... key as the str sent to the server
+    """
+    item = encode_value(item)
+    if isinstance(item, memoryview):
+        return item.tobytes()
+    return str(item)
+
+
+def _item(cache_key):
+    """
+    Filter item of a ('get', key) or ('hget', name, key) cache key
+    """
+    if cache_key[0] == 'get':
+        return 'k' + _string(cache_key[1])
+    name = _string(cache_key[1])
+    return 'h%d:%s%s' % (len(name), name, _string(cache_key[2]))
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of the keys and hashmap keys known to exist.
+
+    A key the filter does not contain is certainly missing,so get/hget can
+    answer 'not_found' without a round trip. Keys written through the SSDB using
+    the filter are added to it, keys written by other clients are not, so the
+    filter must be rebuilt (see from_ssdb) when other writers exist.
+    Deleted keys stay in the filter and only cost a normal server read.
+
+    parameters:
+        capacity:number of keys the filter is sized for
+        error_rate:false positive rate at capacity
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits * math.log(2) / capacity)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in xrange(self.num_hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        bits = self.bits
+        #setting bits is a read-modify-write of a byte
+        with self._lock:
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_key(self, key):
+        self.add(_item(('get', key)))
+
+    def add_hash_key(self, name, key):
+        self.add(_item(('hget', name, key)))
+
+    def might_exist(self, cache_key):
+        """
+        False if the key of a ('get', key) or ('hget', name, key) read certainly doesn't exist
+        """
+        return _item(cache_key) in self
+
+    def invalidate_cmd(self, cmd, params):
+        """
+        Add the keys written by a cmd
+        """
+        keys = cache_invalidations.get(cmd)
+        if keys is not None:
+            for cache_key in keys(params):
+                #('hget', name) stands for a whole cleared hashmap
+                if len(cache_key) > 2 or cache_key[0] == 'get':
+                    self.add(_item(cache_key))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, version, num_bits, num_hashes, count = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("Not a bloom filter file: %s" % path)
+            bits = bytearray(f.read())
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError("Truncated bloom filter file: %s" % path)
+        bloom = cls.__new__(cls)
+        bloom.num_bits, bloom.num_hashes, bloom.count, bloom.bits = num_bits, num_hashes, count, bits
+        bloom.capacity = count
+        bloom.error_rate = None
+        bloom._lock = threading.Lock()
+        return bloom
+
+    @classmethod
+    def from_ssdb(cls, client, capacity, error_rate=0.01, hashes=False, page_size=1000):
+        """
+        Build a filter by sweeping the keys of a SSDB
+
+        parameters:
+            client:SSDB to sweep
+            capacity:number of keys the filter is sized for
+            error_rate:false positive rate at capacity
+            hashes:also sweep the keys of all hashmaps
+            page_size:keys fetched per request
+        """
+        bloom = cls(capacity, error_rate)
+        for key in _sweep(lambda start: client.keys(start, '', page_size)):
+            bloom.add_key(key)
+        if hashes:
+            for name in _sweep(lambda start: client.hlist(start, '', page_size)):
+                for key in _sweep(lambda start: client.hkeys(name, start, '', page_size)):
+                    bloom.add_hash_key(name, key)
+        return bloom
+
+
+def _sweep(fetch):
+    start = ''
+    while True:
+        resp = fetch(start)
+        if not resp.ok():
+            raise ValueError("Sweep failed: %s" % resp.message)
+        if not resp.data:
+            return
+        for key in resp.data:
+            yield key
+        start = resp.data[-1]
@@ -0,0 +1,172 @@
+# encoding=utf-8
+"""
+Streaming bulk loads of key-values,hashmaps and zsets
+"""
+
+import Queue
+import threading
+import time
+
+from ssdb.client import ResponseError, _sizeof
+
+
+class BulkLoader(object):
+    """
+    Load records from an iterator without holding them all in memory.
+
+    Records are cut into chunks of about chunk_bytes,each chunk is sent as one
+    pipeline of multi_set/multi_hset/multi_zset cmds by one of in_flight worker threads.
+    Reading the iterator blocks while in_flight chunks wait to be sent,
+    so at most about 2 * in_flight chunks are held in memory.
+
+    usage:
+        loader = BulkLoader(SSDB('127.0.0.1', 8888, max_connections=4))
+        loader.load(('key_%d' % i, i) for i in xrange(100000000))
+        loader.load_hash((name, key, value) for name, key, value in rows)
+
+    parameters:
+        client:SSDB sending the chunks
+        chunk_bytes:target size of the keys and values of a chunk
+        chunk_items:max records of a chunk
+        in_flight:chunks sent at once,bounded by the client's max_connections
+        progress:function called with the stats dict every progress_interval seconds and at the end
+        progress_interval:seconds between progress calls
+
+    Key-values and hashmap values are encoded with the client's codec.
+    """
+
+    def __init__(self, client, chunk_bytes=1024 * 1024, chunk_items=10000, in_flight=4,
+                 progress=None, progress_interval=1.0):
+        self.client = client
+        self.chunk_bytes = chunk_bytes
+        self.chunk_items = chunk_items
+        pool = getattr(client, 'connection_pool', None)
+        if pool is not None and pool.max_connections is not None:
+            in_flight = min(in_flight, pool.max_connections)
+        self.in_flight = max(1, in_flight)
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+    def load(self, pairs):
+        """
+        Set key-values with multi_set
+
+        parameters:
+            pairs:iterator of (key, value)
+        return:
+            the stats dict
+        """
+        return self._load(((None, key, value) for key, value in pairs), 'multi_set')
+
+    def load_hash(self, triples):
+        """
+        Set hashmap key-values with multi_hset
+
+        parameters:
+            triples:iterator of (name, key, value),records of a hashmap are best kept together
+        return:
+            the stats dict
+        """
+        return self._load(triples, 'multi_hset')
+
+    def load_zset(self, triples):
+        """
+        Set zset key-scores with multi_zset
+
+        parameters:
+            triples:iterator of (name, key, score),records of a zset are best kept together
+        return:
+            the stats dict
+        """
+        return self._load(triples, 'multi_zset')
+
+    def _chunks(self, triples, cmd):
+        """
+        Chunks of (cmd, params) lists,consecutive records of a name share one cmd
+        """
+        codec = getattr(self.client, 'codec', None)
+        encode = codec.encode if codec is not None and cmd != 'multi_zset' else None
+        chunk, params, name, size, count = [], None, None, 0, 0
+        for record_name, key, value in triples:
+            if encode is not None:
+                value = encode(value)
+            if params is None or record_name != name:
+                name = record_name
+                params = [] if name is None else [name]
+                chunk.append((cmd, params))
+            params.append(key)
+            params.append(value)
+            size += _sizeof(key) + _sizeof(value)
+            count += 1
+            if size >= self.chunk_bytes or count >= self.chunk_items:
+                yield chunk, count, size
+                chunk, params, size, count = [], None, 0, 0
+        if chunk:
+            yield chunk, count, size
+
+    def _send(self, chunk):
+        pipe = self.client.pipeline(max_commands=len(chunk) + 1, max_bytes=float('inf'))
+        for cmd, params in chunk:
+            pipe.request(cmd, params)
+        for resp in pipe.execute():
+            if not resp.ok():
+                raise ResponseError(resp.code, resp.message)
+
+    def _load(self, triples, cmd):
+        stats = {'items': 0, 'bytes': 0, 'chunks': 0, 'seconds': 0.0,
+                 'items_per_second': 0.0, 'bytes_per_second': 0.0}
+        lock = threading.Lock()
+        errors = []
+        chunks = Queue.Queue(maxsize=self.in_flight)
+        start = time.time()
+
+        def work():
+            while True:
+                item = chunks.get()
+                if item is None:
+                    return
+                if errors:
+                    #drain the queue so the reader is not blocked
+                    continue
+                chunk, count, size = item
+                try:
+                    self._send(chunk)
+                except Exception, e:
+                    errors.append(e)
+                    continue
+                with lock:
+                    stats['items'] += count
+                    stats['bytes'] += size
+                    stats['chunks'] += 1
+
+        def update():
+            with lock:
+                stats['seconds'] = seconds = time.time() - start
+                stats['items_per_second'] = stats['items'] / seconds if seconds else 0.0
+                stats['bytes_per_second'] = stats['bytes'] / seconds if seconds else 0.0
+                return dict(stats)
+
+        workers = [threading.Thread(target=work) for _ in xrange(self.in_flight)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        reported = start
+        try:
+            for item in self._chunks(triples, cmd):
+                if errors:
+                    break
+                chunks.put(item)
+                if self.progress is not None and time.time() - reported >= self.progress_interval:
+                    reported = time.time()
+                    self.progress(update())
+        finally:
+            for worker in workers:
+                chunks.put(None)
+            for worker in workers:
+                worker.join()
+        if errors:
+            raise errors[0]
+        result = update()
+        if self.progress is not None:
+            self.progress(result)
+        return result
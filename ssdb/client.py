@@ -4,8 +4,37 @@ Python client for ssdb
 """
 
 import socket
-from itertools import izip, chain
+from array import array
+from itertools import izip, chain, islice, imap
 import os
+import select
+import struct
+import threading
+import time
+import random
+import Queue
+from collections import deque, OrderedDict, Mapping
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+try:
+    from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+except ImportError:
+    Future = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    array('q')
+    _INT64 = 'q'
+except ValueError:
+    #python 2 has no 'q',long is 64 bit on LP64 platforms
+    _INT64 = 'l' if array('l').itemsize == 8 else None
+
+_INT_TYPECODES = frozenset('bBhHiIlLqQ')
 
 update_cmd = ['set', 'setx', 'zset', 'hset', 'del', 'zdel', 'hdel', 'multi_set', 'multi_del', 'multi_hset', 'multi_hdel',
               'multi_zset', 'multi_zdel']
@@ -20,6 +49,145 @@ scan_key = ['scan', 'rscan', 'hscan', 'hrscan', 'multi_get', 'multi_hget']
 
 zscan_key = ['zscan', 'zrscan', 'zrange', 'zrrange', 'multi_zget']
 
+#multi_* cmd -> (number of params before the keys, params per key)
+multi_cmd_layouts = {
+    'multi_get': (0, 1), 'multi_del': (0, 1), 'multi_exists': (0, 1), 'multi_set': (0, 2),
+    'multi_hget': (1, 1), 'multi_hdel': (1, 1), 'multi_hset': (1, 2),
+    'multi_zget': (1, 1), 'multi_zdel': (1, 1), 'multi_zset': (1, 2),
+}
+
+#cmds that can be sent to a replica
+read_cmd = set(single_get_cmd + key_cmd + scan_key + zscan_key + ['hsize', 'zsize', 'zget', 'zrank', 'zrrank',
+                                                                   'exists', 'multi_exists', 'ttl', 'strlen',
+                                                                   'hexists', 'hgetall', 'zcount', 'zsum', 'zavg',
+                                                                   'qsize', 'qslice'])
+
+if Future is None:
+    class FutureTimeoutError(Exception):
+        pass
+
+    class Future(object):
+        """
+        Minimal concurrent.futures.Future for when the futures backport is not installed
+        """
+
+        def __init__(self):
+            self._event = threading.Event()
+            self._result = None
+            self._exception = None
+            self._callbacks = []
+            self._lock = threading.Lock()
+
+        def done(self):
+            return self._event.is_set()
+
+        def result(self, timeout=None):
+            if not self._event.wait(timeout):
+                raise FutureTimeoutError()
+            if self._exception is not None:
+                raise self._exception
+            return self._result
+
+        def exception(self, timeout=None):
+            if not self._event.wait(timeout):
+                raise FutureTimeoutError()
+            return self._exception
+
+        def add_done_callback(self, fn):
+            with self._lock:
+                if not self._event.is_set():
+                    self._callbacks.append(fn)
+                    return
+            fn(self)
+
+        def set_result(self, result):
+            self._result = result
+            self._finish()
+
+        def set_exception(self, exception):
+            self._exception = exception
+            self._finish()
+
+        def _finish(self):
+            with self._lock:
+                self._event.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for fn in callbacks:
+                fn(self)
+
+#values at least that many bytes long are written to the socket as they are instead of being joined
+send_join_threshold = 1024 * 64
+
+_cmd_headers = {}
+
+
+def _cmd_header(cmd):
+    try:
+        return _cmd_headers[cmd]
+    except KeyError:
+        header = _cmd_headers[cmd] = '%d\n%s' % (len(cmd), cmd)
+        return header
+
+
+def encode_value(item):
+    """
+    Encode an item the way it is sent to the server
+    """
+    if isinstance(item, str):
+        return item
+    if isinstance(item, (int, long)):
+        return str(item)
+    if isinstance(item, unicode):
+        return item.encode('utf-8')
+    if isinstance(item, (bytearray, memoryview)):
+        if len(item) < send_join_threshold:
+            return str(item) if isinstance(item, bytearray) else item.tobytes()
+        return item
+    return str(item)
+
+
+def encode_key(key):
+    """
+    A key or name as the str the server sees,e.g. to look it up in a response
+    """
+    if type(key) is str:
+        return key
+    key = encode_value(key)
+    if isinstance(key, memoryview):
+        return key.tobytes()
+    return str(key)
+
+
+def encode_cmd(cmd, params):
+    """
+    Encode a ssdb cmd as a list of chunks to be sent in order.
+
+    Small items are joined together with their length prefixes,
+    large str/bytearray/memoryview values are kept as separate chunks
+    so they are never copied.
+    """
+    chunks = []
+    parts = [_cmd_header(cmd)]
+    append = parts.append
+    for item in params:
+        if type(item) is not str:
+            item = encode_value(item)
+
+        size = len(item)
+        append(str(size))
+        if size >= send_join_threshold:
+            append('')
+            chunks.append('\n'.join(parts))
+            chunks.append(item)
+            parts = ['']
+            append = parts.append
+        else:
+            append(item)
+    append('')
+    append('')
+    chunks.append('\n'.join(parts))
+    return chunks
+
 
 class SSDBResponse(object):
     """
@@ -31,6 +199,8 @@ class SSDBResponse(object):
 
     """
 
+    __slots__ = ('code', 'data', 'message')
+
     def __init__(self, code='', data_or_message=None):
         self.code = code
         self.data = None
@@ -51,6 +221,312 @@ class SSDBResponse(object):
         return self.code == 'not_found'
 
 
+class ScanResult(Mapping):
+    """
+    Data of a scan style response,kept as the flat reply list of keys and values.
+
+    A read-only mapping of 'index' and 'items' like the dict it replaces,
+    result['index'] (keys list) and result['items'] (key-value dict) are built
+    when first accessed,pairs() reads the reply without building them.
+    dict(result) gives a plain dict,e.g. for json.dumps.
+
+    parameters:
+        reply:list of keys and values
+        start:position of the first key in reply
+        convert:function applied to the values when read,e.g. int for zset scores
+    """
+
+    __slots__ = ('_reply', '_start', '_convert', '_index', '_items')
+
+    def __init__(self, reply, start=0, convert=None):
+        self._reply = reply
+        self._start = start
+        self._convert = convert
+        self._index = None
+        self._items = None
+
+    @classmethod
+    def from_items(cls, index, items):
+        return cls([value for key in index for value in (key, items[key])])
+
+    @classmethod
+    def concat(cls, results):
+        """
+        One result holding the pairs of results in order
+        """
+        reply = []
+        for result in results:
+            reply.extend(islice(result._reply, result._start, None))
+        return cls(reply, 0, results[0]._convert if results else None)
+
+    def converted(self, convert):
+        """
+        A result of the same reply whose values are passed through convert
+        """
+        if self._convert is not None:
+            convert = lambda value, first=self._convert, then=convert: then(first(value))
+        return ScanResult(self._reply, self._start, convert)
+
+    def columns(self, typecode='q', use_numpy=None):
+        """
+        Keys and values as columns,the values converted to numbers in one pass,
+        e.g. the scores of zscan/zrscan/multi_zget or numeric multi_get values.
+
+        parameters:
+            typecode:array typecode,e.g. 'q' for 64 bit ints,'i' for ints,'d' for floats
+            use_numpy:return a numpy array,defaults to True if numpy is installed
+        return:
+            (keys list, values array),an array.array or a numpy array
+        """
+        values = self._reply[self._start + 1::2]
+        if self._convert not in (None, int, float):
+            values = map(self._convert, values)
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy:
+            #numpy parses the strings in bulk
+            return self['index'], numpy.array(values).astype(typecode)
+        if typecode in ('q', 'Q'):
+            if _INT64 is None:
+                raise ValueError("array has no 64 bit integer typecode on this platform,use numpy")
+            #python 2 names them 'l' and 'L'
+            typecode = _INT64 if typecode == 'q' else _INT64.upper()
+        return self['index'], array(typecode, imap(int if typecode in _INT_TYPECODES else float, values))
+
+    def _values(self):
+        values = islice(self._reply, self._start + 1, None, 2)
+        return imap(self._convert, values) if self._convert is not None else values
+
+    def pairs(self):
+        """
+        return:
+            a list of key-value tuples in reply order
+        """
+        return zip(islice(self._reply, self._start, None, 2), self._values())
+
+    def __getitem__(self, name):
+        if name == 'index':
+            if self._index is None:
+                self._index = self._reply[self._start::2]
+            return self._index
+        if name == 'items':
+            if self._items is None:
+                self._items = dict(izip(islice(self._reply, self._start, None, 2), self._values()))
+            return self._items
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in ('index', 'items')
+
+    def __iter__(self):
+        return iter(('index', 'items'))
+
+    def __len__(self):
+        return 2
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, ScanResult)):
+            return self['index'] == other.get('index') and self['items'] == other.get('items')
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return repr({'index': self['index'], 'items': self['items']})
+
+
+def _parse_count(resp):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0], resp[1] if len(resp) > 1 else None)
+    if len(resp) > 1:
+        return SSDBResponse(resp[0], int(resp[1]))
+    return SSDBResponse(resp[0], 1)
+
+
+def _parse_value(resp):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0])
+    if len(resp) != 2:
+        return SSDBResponse('server_error', 'Invalid response')
+    return SSDBResponse('ok', resp[1])
+
+
+def _parse_int(resp):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0])
+    try:
+        return SSDBResponse('ok', int(resp[1]))
+    except (IndexError, ValueError):
+        return SSDBResponse('server_error', 'Invalid response')
+
+
+def _parse_float(resp):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0])
+    try:
+        return SSDBResponse('ok', float(resp[1]))
+    except (IndexError, ValueError):
+        return SSDBResponse('server_error', 'Invalid response')
+
+
+def _parse_bool(resp):
+    resp = _parse_int(resp)
+    if resp.ok():
+        resp.data = resp.data != 0
+    return resp
+
+
+def _str_items(resp, start, step):
+    """
+    Make the keys returned as memoryview by a low memoryview_threshold str,they are hashed
+    """
+    if memoryview in imap(type, resp):
+        for index in xrange(start, len(resp), step):
+            if type(resp[index]) is memoryview:
+                resp[index] = resp[index].tobytes()
+
+
+def _parse_list(resp):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0])
+    return SSDBResponse('ok', resp[1:])
+
+
+def _parse_keys(resp):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0])
+    _str_items(resp, 1, 1)
+    return SSDBResponse('ok', resp[1:])
+
+
+def _parse_pairs(resp, convert=None):
+    if resp[0] != 'ok':
+        return SSDBResponse(resp[0])
+    if len(resp) % 2 != 1:
+        return SSDBResponse('server_error', 'Invalid response')
+    _str_items(resp, 1, 2)
+    #index/items are built when used
+    return SSDBResponse('ok', ScanResult(resp, 1, convert))
+
+
+def _parse_scores(resp):
+    #scores are converted to int when used
+    return _parse_pairs(resp, int)
+
+
+def _parse_multi_bool(resp):
+    resp = _parse_pairs(resp)
+    if resp.ok():
+        resp.data = dict((key, value != '0') for key, value in resp.data.pairs())
+    return resp
+
+
+#cmd -> function turning its reply list into a SSDBResponse
+response_parsers = {}
+for _cmds, _parser in ((update_cmd, _parse_count),
+                       (single_get_cmd + ['getset'], _parse_value),
+                       (incr_cmd + ['ttl', 'strlen', 'hclear', 'zclear', 'zcount', 'zsum',
+                                    'zremrangebyscore', 'zremrangebyrank',
+                                    'qpush_back', 'qpush_front', 'qsize', 'qclear'], _parse_int),
+                       (['zavg'], _parse_float),
+                       (['exists', 'hexists', 'setnx', 'expire'], _parse_bool),
+                       (key_cmd, _parse_keys),
+                       (['qpop_front', 'qpop_back', 'qslice'], _parse_list),
+                       (scan_key + ['hgetall'], _parse_pairs),
+                       (zscan_key, _parse_scores),
+                       (['multi_exists'], _parse_multi_bool)):
+    response_parsers.update(dict.fromkeys(_cmds, _parser))
+del _cmds, _parser
+
+
+#cmd -> (parser, read, invalidation) before register_command,for unregister_command
+registered_cmds = {}
+
+
+def register_command(cmd, parser=_parse_list, read=None, invalidates=None):
+    """
+    Register a server cmd,every SSDB then has a method named cmd sending it with the method's arguments
+
+    usage:
+        register_command('qfront', ssdb.client._parse_value, read=True)
+        ssdb.qfront('queue')
+
+    parameters:
+        cmd:cmd name
+        parser:function turning the reply list into a SSDBResponse,
+            the default returns the reply items after the code as data
+        read:the cmd only reads,so it may be sent to replicas,None keeps what is known of cmd
+        invalidates:function returning the cache keys written by the cmd's params,
+            ('get', key),('hget', name, key) or ('hget', name) for a whole hashmap,
+            None keeps the invalidation known for cmd
+    """
+    if cmd not in registered_cmds:
+        registered_cmds[cmd] = (response_parsers.get(cmd), cmd in read_cmd, cache_invalidations.get(cmd))
+    response_parsers[cmd] = parser
+    if read:
+        read_cmd.add(cmd)
+    elif read is not None:
+        read_cmd.discard(cmd)
+    if invalidates is not None:
+        cache_invalidations[cmd] = invalidates
+
+
+def unregister_command(cmd):
+    """
+    Undo register_command,cmd's method is removed and what was known of cmd restored
+    """
+    parser, read, invalidates = registered_cmds.pop(cmd)
+    for table, value in ((response_parsers, parser), (cache_invalidations, invalidates)):
+        if value is None:
+            table.pop(cmd, None)
+        else:
+            table[cmd] = value
+    if read:
+        read_cmd.add(cmd)
+    else:
+        read_cmd.discard(cmd)
+
+
+class RawSSDB(object):
+    """
+    A client whose methods return the response data instead of a SSDBResponse.
+
+    'not_found' is returned as None,other failed responses raise ResponseError(code, message).
+    Methods not returning a SSDBResponse,e.g. the iterators,are unchanged.
+
+    usage:
+        raw = RawSSDB(SSDB('127.0.0.1', 8888))
+        raw.get('key')
+
+    parameters:
+        client:SSDB or ShardedSSDB sending the cmds
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            resp = method(*args, **kwargs)
+            if not isinstance(resp, SSDBResponse):
+                return resp
+            if resp.code == 'ok':
+                return resp.data
+            if resp.code == 'not_found':
+                return None
+            raise ResponseError(resp.code, resp.message)
+        call.__name__ = name
+        #later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+
+
 class SSDB(object):
     """
     A client for ssdb
@@ -60,14 +536,141 @@ class SSDB(object):
         port:port to connect
         socket_timeout:socket_timeout to set
         max_connections:connection pool's max connection count
+        memoryview_threshold:values at least that many bytes long are returned as memoryview,
+            None means values are always str
+        coalesce_window:seconds get/hget/zget wait for concurrent reads of other threads
+            to be merged into one multi_get/multi_hget/multi_zget,None disables coalescing
+        coalesce_max_batch:send the merged request as soon as it holds that many keys
+        pool_timeout:seconds to wait for a free connection when max_connections are in use,
+            0 means fail at once,None means wait forever
+        connection_pool:a ConnectionPool to use instead of creating one,
+            connection parameters above are ignored then
+        multiplex:send requests of all threads over one MultiplexedConnection instead of the pool,
+            every method then has an '_async' variant returning a Future,e.g. get_async(key)
+        cache_max_bytes:cache get/hget responses in a ReadCache of that size,None disables the cache
+        cache_ttl:seconds a cached response lives,None means until evicted or invalidated
+        disk_cache:a DiskCache serving get/multi_get values behind the ReadCache
+        bloom_filter:a BloomFilter of existing keys,get/hget of keys it doesn't contain
+            return 'not_found' without a request
+        replicas:list of (host, port) of replicas of the server,reads are then sent to
+            the replica with the lowest recent latency and writes to host/port,
+            see use_master() to read from the master
+        hedger:a RequestHedger duplicating reads that are slow to answer,the duplicate is sent
+            to the master if replicas are set,else on another connection of the pool
+        chunk_keys:multi_* cmds with more keys are split in chunks of that many keys,
+            None disables splitting
+        chunk_bytes:multi_* cmds are also split so the keys and values of a chunk stay below that size,
+            chunks are sent in parallel if pool_timeout lets them wait for connections,else pipelined
+        codec:object with encode(value) returning a str and decode(data) returning the value,
+            see ssdb.codec. Values are encoded by set/setnx/getset/hset/multi_set/multi_hset/qpush_*
+            and decoded by the methods reading key-values,hashmap values and queue items,
+            including those of pipelines and the '_async' methods.
+        metrics:a ClientMetrics recording the requests and the pools' checkout waits,
+            see ssdb.metrics
     """
 
-    def __init__(self, host='127.0.0.1', port=8888, socket_timeout=None, max_connections=1):
+    coalescer = None
+    multiplexer = None
+    cache = None
+    disk_cache = None
+    bloom_filter = None
+    replica_router = None
+    hedger = None
+    #caches invalidated by writes
+    caches = ()
+    chunk_keys = None
+    chunk_bytes = None
+    #threads sending the chunks of a multi_* cmd in parallel
+    max_chunk_workers = 8
+    codec = None
+    metrics = None
+
+    def __init__(self, host='127.0.0.1', port=8888, socket_timeout=None, max_connections=1,
+                 memoryview_threshold=None, coalesce_window=None, coalesce_max_batch=64,
+                 pool_timeout=0, connection_pool=None, multiplex=False, cache_max_bytes=None, cache_ttl=None,
+                 disk_cache=None, bloom_filter=None, replicas=None, hedger=None,
+                 chunk_keys=10000, chunk_bytes=4 * 1024 * 1024, codec=None, metrics=None):
         self.host = host
         self.port = port
         self.socket_timeout = socket_timeout
         self.max_connections = max_connections
-        self.connection_pool = ConnectionPool(self.host, self.port, self.socket_timeout, self.max_connections)
+        if connection_pool is None:
+            connection_pool = ConnectionPool(self.host, self.port, self.socket_timeout, self.max_connections,
+                                             memoryview_threshold, pool_timeout)
+        self.connection_pool = connection_pool
+        if coalesce_window is not None:
+            self.coalescer = RequestCoalescer(self.request, coalesce_window, coalesce_max_batch)
+        if cache_max_bytes is not None:
+            self.cache = ReadCache(cache_max_bytes, cache_ttl)
+        self.disk_cache = disk_cache
+        self.bloom_filter = bloom_filter
+        self.caches = tuple(cache for cache in (self.cache, self.disk_cache, self.bloom_filter)
+                            if cache is not None)
+        if multiplex:
+            self.multiplexer = MultiplexedConnection(self.host, self.port, self.parse_response,
+                                                     memoryview_threshold)
+            self._future_client = _FutureClient(self.multiplexer, self.caches, codec)
+        if replicas:
+            self.replica_router = ReplicaRouter([ConnectionPool(replica_host, replica_port, socket_timeout,
+                                                                max_connections, memoryview_threshold, pool_timeout)
+                                                 for replica_host, replica_port in replicas])
+            self._local = threading.local()
+        self.hedger = hedger
+        self.chunk_keys = chunk_keys
+        self.chunk_bytes = chunk_bytes
+        self._chunk_workers = None
+        self._chunk_lock = threading.Lock()
+        self.codec = codec
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.watch_pool(self.connection_pool)
+            if self.replica_router is not None:
+                for pool in self.replica_router.pools:
+                    metrics.watch_pool(pool)
+
+    def __getattr__(self, name):
+        if name.endswith('_async') and self.multiplexer is not None:
+            return getattr(self._future_client, name[:-len('_async')])
+        if name in registered_cmds:
+            #a cmd added with register_command
+            def command(*params):
+                return self.request(name, list(params))
+            command.__name__ = name
+            return command
+        raise AttributeError(name)
+
+    def _encode(self, value):
+        if self.codec is None:
+            return value
+        return self.codec.encode(value)
+
+    def _encode_pairs(self, key_value_map):
+        """
+        Flat list of the keys and encoded values of a dict
+        """
+        if self.codec is None:
+            return list(chain.from_iterable(key_value_map.iteritems()))
+        encode = self.codec.encode
+        return [item for key, value in key_value_map.iteritems() for item in (key, encode(value))]
+
+    def _decode(self, resp):
+        """
+        Decode the values of a response,or of the response of a Future
+        """
+        if self.codec is None:
+            return resp
+        if Future is not None and isinstance(resp, Future):
+            return _then(resp, self._decode)
+        if not isinstance(resp, SSDBResponse) or not resp.ok():
+            return resp
+        data = resp.data
+        if isinstance(data, ScanResult):
+            data = data.converted(self.codec.decode)
+        elif isinstance(data, list):
+            data = map(self.codec.decode, data)
+        else:
+            data = self.codec.decode(data)
+        return SSDBResponse('ok', data)
 
     def set(self, key, value, ttl=None):
         """
@@ -79,9 +682,21 @@ class SSDB(object):
         return:
             'ok' code if success,other code failed.
         """
+        value = self._encode(value)
         if not ttl or int(ttl) == -1:
-            return self.request("set", [key, value])
-        return self.request("setx", [key, value, int(ttl)])
+            ttl = None
+            resp = self.request("set", [key, value])
+        else:
+            ttl = int(ttl)
+            resp = self.request("setx", [key, value, ttl])
+        if (self.cache is not None or self.disk_cache is not None) and resp.ok():
+            if self.cache is not None:
+                encoded = encode_value(value)
+                if isinstance(encoded, str):
+                    self.cache.put(("get", encode_key(key)), SSDBResponse('ok', encoded), ttl)
+            if self.disk_cache is not None:
+                self.disk_cache.put(key, value, ttl)
+        return resp
 
     def get(self, key):
         """
@@ -92,7 +707,68 @@ class SSDB(object):
             'not_found' code if key not exist;
             other code failed
         """
-        return self.request("get", [key])
+        if self.cache is not None:
+            return self._decode(self.cache.load(("get", encode_key(key)), self._read, "get", None, key))
+        return self._decode(self._read("get", None, key))
+
+    def setnx(self, key, value):
+        """
+        Set key's value if key doesn't exist
+
+        return:
+            'ok' code if success,'data' is True if the value was set;other code failed
+        """
+        return self.request("setnx", [key, self._encode(value)])
+
+    def getset(self, key, value):
+        """
+        Set key's value and return the old one
+
+        return:
+            'ok' code if success,'data' contain the old value;
+            'not_found' code if key didn't exist;
+            other code failed
+        """
+        return self._decode(self.request("getset", [key, self._encode(value)]))
+
+    def expire(self, key, ttl):
+        """
+        Set the time to live of key's value
+
+        parameters:
+            ttl:seconds
+
+        return:
+            'ok' code if success,'data' is True if key exists;other code failed
+        """
+        return self.request("expire", [key, int(ttl)])
+
+    def ttl(self, key):
+        """
+        Get the time to live of key's value
+
+        return:
+            'ok' code if success,'data' is the seconds left,-1 if key has no ttl;other code failed
+        """
+        return self.request("ttl", [key])
+
+    def exists(self, key):
+        """
+        Check whether key exists
+
+        return:
+            'ok' code if success,'data' is True or False;other code failed
+        """
+        return self.request("exists", [key])
+
+    def strlen(self, key):
+        """
+        Get the length of key's value
+
+        return:
+            'ok' code if success,'data' is the length,0 if key doesn't exist;other code failed
+        """
+        return self.request("strlen", [key])
 
     def delete(self, key):
         """
@@ -135,6 +811,19 @@ class SSDB(object):
         """
         return self.request("keys", [key_lower, key_upper, limit])
 
+    def keys_iterator(self, key_lower='', key_upper='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return an iterator of keys in range (key_lower,key_upper].
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _list_page(self.keys(start, key_upper, limit)),
+                                    key_lower, page_size, page_bytes, prefetch)
+
     def scan(self, key_lower, key_upper, limit):
         """
         list key-value pairs in key range (key_lower,key_upper]
@@ -147,20 +836,20 @@ class SSDB(object):
             'ok',code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
             other code failed
         """
-        return self.request("scan", [key_lower, key_upper, limit])
+        return self._decode(self.request("scan", [key_lower, key_upper, limit]))
 
-    def scan_iterator(self, key_lower):
+    def scan_iterator(self, key_lower, key_upper='', page_size=None, page_bytes=256 * 1024, prefetch=None):
         """
-        return a key-value tuple iterator.
-        """
-        start_key = key_lower
-        while start_key is not None:
-            response = self.scan(start_key, "", 1000)
-            index, items = response.data['index'], response.data['items']
-            start_key = index[-1] if index else None
-            for key in index:
-                yield (key, items[key])
+        return a key-value tuple iterator over key range (key_lower,key_upper].
 
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _pairs_page(self.scan(start, key_upper, limit)),
+                                    key_lower, page_size, page_bytes, prefetch)
 
     def rscan(self, key_upper, key_lower, limit):
         """
@@ -174,7 +863,45 @@ class SSDB(object):
             'ok',code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
             other code failed
         """
-        return self.request("rscan", [key_upper, key_lower, limit])
+        return self._decode(self.request("rscan", [key_upper, key_lower, limit]))
+
+    def rscan_iterator(self, key_upper, key_lower='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return a key-value tuple iterator over key range (key_upper,key_lower] in reverse order.
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _pairs_page(self.rscan(start, key_lower, limit)),
+                                    key_upper, page_size, page_bytes, prefetch)
+
+    def parallel_scan(self, key_lower='', key_upper='', parts=8, boundaries=None, ordered=False,
+                      page_size=None, page_bytes=256 * 1024, workers=None):
+        """
+        Scan key range (key_lower,key_upper] split in sub-ranges,scanned concurrently on their own connections.
+
+        parameters:
+            parts:number of sub-ranges when boundaries is None,split keys are then sampled with keys
+            boundaries:keys splitting the range,sub-ranges are (key_lower,b1],(b1,b2]...(bn,key_upper]
+            ordered:False yields lists of key-value tuples as soon as they are fetched,
+                True yields key-value tuples in key order
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            workers:number of sub-ranges scanned at once,defaults to parts bounded by the pool size
+        """
+        def next_key(start):
+            keys = _list_page(self.keys(start, key_upper, 1))[0]
+            return keys[0] if keys else None
+
+        def sample(parts):
+            last = _pairs_page(self.rscan(key_upper, key_lower, 1))[0]
+            return _sample_boundaries(next_key, last[0][0] if last else None, key_lower, parts)
+        return self._parallel_range(lambda start, upper, limit: _pairs_page(self.scan(start, upper, limit)),
+                                    sample, key_lower, key_upper, parts, boundaries, ordered,
+                                    page_size, page_bytes, workers)
 
     def multi_set(self, key_value_map):
         """
@@ -185,10 +912,19 @@ class SSDB(object):
         return 'ok' code if success,other code failed
 
         """
-        l = []
-        for key, value in key_value_map.items():
-            l = l + [key, value]
-        return self.request("multi_set", l)
+        return self.request("multi_set", self._encode_pairs(key_value_map))
+
+    def multi_exists(self, keys):
+        """
+        Check whether those keys exist
+
+        parameters:
+            keys:keys list
+
+        return:
+            'ok' code if success,'data' is a key-bool dict;other code failed
+        """
+        return self.request("multi_exists", keys)
 
     def multi_get(self, keys):
         """
@@ -199,9 +935,27 @@ class SSDB(object):
 
         return:
             return 'ok' code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
-            other code failed
-        """
-        return self.request("multi_get", keys)
+            other code failed;
+            for numeric values data.columns() returns the keys and an array of the values
+        """
+        if self.disk_cache is not None:
+            return self._decode(self._disk_cached_multi_get(keys))
+        return self._decode(self.request("multi_get", keys))
+
+    def _disk_cached_multi_get(self, keys):
+        #the cache and the response are keyed by the str sent
+        keys = map(encode_key, keys)
+        found = self.disk_cache.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            since = time.time()
+            resp = self.request("multi_get", missing)
+            if not resp.ok():
+                return resp
+            fetched = resp.data['items']
+            self.disk_cache.put_many(fetched.iteritems(), since=since)
+            found.update(fetched)
+        return SSDBResponse('ok', ScanResult.from_items([key for key in keys if key in found], found))
 
     def multi_del(self, keys):
         """
@@ -227,7 +981,7 @@ class SSDB(object):
         return:
             'ok' code if success,other code failed.
         """
-        return self.request("hset", [name, key, value])
+        return self.request("hset", [name, key, self._encode(value)])
 
     def hget(self, name, key):
         """
@@ -240,7 +994,48 @@ class SSDB(object):
         return:
             'ok' code if success,'data' contain value;other code failed
         """
-        return self.request("hget", [name, key])
+        if self.cache is not None:
+            return self._decode(self.cache.load(("hget", encode_key(name), encode_key(key)),
+                                                self._read, "hget", name, key))
+        return self._decode(self._read("hget", name, key))
+
+    def hexists(self, name, key):
+        """
+        Check whether a key of a hashmap exists
+
+        parameters:
+            name:hashmap's name
+            key:key
+
+        return:
+            'ok' code if success,'data' is True or False;other code failed
+        """
+        return self.request("hexists", [name, key])
+
+    def hgetall(self, name):
+        """
+        Get all key-value pairs of a hashmap
+
+        parameters:
+            name:hashmap's name
+
+        return:
+            'ok' code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
+            other code failed
+        """
+        return self._decode(self.request("hgetall", [name]))
+
+    def hclear(self, name):
+        """
+        Delete all keys of a hashmap
+
+        parameters:
+            name:hashmap's name
+
+        return:
+            'ok' code if success,'data' is the number of deleted keys;other code failed
+        """
+        return self.request("hclear", [name])
 
     def hdel(self, name, key):
         """
@@ -308,6 +1103,19 @@ class SSDB(object):
         """
         return self.request("hlist", [name_lower, name_upper, limit])
 
+    def hlist_iterator(self, name_lower='', name_upper='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return an iterator of hashmap names in range (name_lower,name_upper].
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _list_page(self.hlist(start, name_upper, limit)),
+                                    name_lower, page_size, page_bytes, prefetch)
+
     def hkeys(self, name, key_lower, key_upper, limit):
         """
         Get keys in range (name_lower,name_upper] of a hashmap
@@ -323,6 +1131,19 @@ class SSDB(object):
         """
         return self.request("hkeys", [name, key_lower, key_upper, limit])
 
+    def hkeys_iterator(self, name, key_lower='', key_upper='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return an iterator of keys in range (key_lower,key_upper] of a hashmap.
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _list_page(self.hkeys(name, start, key_upper, limit)),
+                                    key_lower, page_size, page_bytes, prefetch)
+
     def hscan(self, name, key_lower, key_upper, limit):
         """
         list key-value pairs in key range (key_lower,key_upper] of a hashmap
@@ -336,7 +1157,20 @@ class SSDB(object):
             'ok',code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
             other code failed
         """
-        return self.request("hscan", [name, key_lower, key_upper, limit])
+        return self._decode(self.request("hscan", [name, key_lower, key_upper, limit]))
+
+    def hscan_iterator(self, name, key_lower='', key_upper='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return a key-value tuple iterator over key range (key_lower,key_upper] of a hashmap.
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _pairs_page(self.hscan(name, start, key_upper, limit)),
+                                    key_lower, page_size, page_bytes, prefetch)
 
     def hrscan(self, name, key_end, key_start, limit):
         """
@@ -351,7 +1185,37 @@ class SSDB(object):
             'ok',code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
             other code failed
         """
-        return self.request("hrscan", [name, key_end, key_start, limit])
+        return self._decode(self.request("hrscan", [name, key_end, key_start, limit]))
+
+    def hrscan_iterator(self, name, key_upper='', key_lower='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return a key-value tuple iterator over key range (key_upper,key_lower] of a hashmap in reverse order.
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _pairs_page(self.hrscan(name, start, key_lower, limit)),
+                                    key_upper, page_size, page_bytes, prefetch)
+
+    def parallel_hscan(self, name, key_lower='', key_upper='', parts=8, boundaries=None, ordered=False,
+                       page_size=None, page_bytes=256 * 1024, workers=None):
+        """
+        Scan key range (key_lower,key_upper] of a hashmap split in sub-ranges,
+        scanned concurrently on their own connections,see parallel_scan.
+        """
+        def next_key(start):
+            keys = _list_page(self.hkeys(name, start, key_upper, 1))[0]
+            return keys[0] if keys else None
+
+        def sample(parts):
+            last = _pairs_page(self.hrscan(name, key_upper, key_lower, 1))[0]
+            return _sample_boundaries(next_key, last[0][0] if last else None, key_lower, parts)
+        return self._parallel_range(lambda start, upper, limit: _pairs_page(self.hscan(name, start, upper, limit)),
+                                    sample, key_lower, key_upper, parts, boundaries, ordered,
+                                    page_size, page_bytes, workers)
 
     def multi_hset(self, name, key_value_map):
         """
@@ -364,10 +1228,7 @@ class SSDB(object):
         return 'ok' code if success,other code failed
 
         """
-        l = [name]
-        for key, value in key_value_map.items():
-            l = l + [key, value]
-        return self.request("multi_hset", l)
+        return self.request("multi_hset", [name] + self._encode_pairs(key_value_map))
 
     def multi_hget(self, name, keys):
         """
@@ -381,7 +1242,7 @@ class SSDB(object):
             return 'ok' code if success,'data["index"]' is a keys list,'data["items"]' is key-value dict
             other code failed
         """
-        return self.request("multi_hget", [name] + keys)
+        return self._decode(self.request("multi_hget", [name] + keys))
 
     def multi_hdel(self, name, keys):
         """
@@ -421,7 +1282,7 @@ class SSDB(object):
         return:
             return 'ok' code if success,'data' contain key's score;other code failed
         """
-        return self.request("zget", [name, key])
+        return self._read("zget", name, key)
 
     def zdel(self, name, key):
         """
@@ -462,6 +1323,18 @@ class SSDB(object):
         """
         return self.request("zsize", [name])
 
+    def zclear(self, name):
+        """
+        Delete all keys of a zset
+
+        parameters:
+            name:zset name
+
+        return:
+            'ok' code if success,'data' is the number of deleted keys;other code failed
+        """
+        return self.request("zclear", [name])
+
     def zlist(self, name_lower, name_upper, limit):
         """
         Get zset names in range (name_lower,name_upper]
@@ -476,6 +1349,19 @@ class SSDB(object):
         """
         return self.request("zlist", [name_lower, name_upper, limit])
 
+    def zlist_iterator(self, name_lower='', name_upper='', page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return an iterator of zset names in range (name_lower,name_upper].
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        return self._range_iterator(lambda start, limit: _list_page(self.zlist(start, name_upper, limit)),
+                                    name_lower, page_size, page_bytes, prefetch)
+
     def zkeys(self, name, key_lower, score_lower, score_upper, limit):
         """
         List keys of a zset in range (key_lower+score_lower, score_upper].
@@ -494,6 +1380,21 @@ class SSDB(object):
         """
         return self.request("zkeys", [name, key_lower, score_lower, score_upper, limit])
 
+    def zkeys_iterator(self, name, key_lower='', score_lower='', score_upper='',
+                       page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return an iterator of keys of a zset in range (key_lower+score_lower, score_upper].
+        Pages are fetched with zscan,whose scores tell where the next page starts.
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        pairs = self.zscan_iterator(name, key_lower, score_lower, score_upper, page_size, page_bytes, prefetch)
+        return (key for key, score in pairs)
+
     def zscan(self, name, key_lower, score_lower, score_upper, limit):
         """
         List key-score pairs of a zset in range (key_lower+score_lower, score_upper].
@@ -508,10 +1409,26 @@ class SSDB(object):
             limit - Up to that many elements will be returned.
 
         return:
-            'ok' code if success,'data['index']' is keys list,'data[items] is key-score pairs';other code failed
+            'ok' code if success,'data['index']' is keys list,'data[items] is key-score pairs';other code failed;
+            data.columns() returns the keys and an array of the scores
         """
         return self.request("zscan", [name, key_lower, score_lower, score_upper, limit])
 
+    def zscan_iterator(self, name, key_lower='', score_lower='', score_upper='',
+                       page_size=None, page_bytes=256 * 1024, prefetch=None):
+        """
+        return a key-score tuple iterator over range (key_lower+score_lower, score_upper] of a zset.
+
+        parameters:
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        def fetch(start, limit):
+            return _zpairs_page(self.zscan(name, start[0], start[1], score_upper, limit))
+        return self._range_iterator(fetch, (key_lower, score_lower), page_size, page_bytes, prefetch)
+
     def zrscan(self, name, key_upper, score_upper, score_lower, limit):
         """
         List key-score pairs of a zset in range (key_upper+score_upper, score_lower] in reverse order.
@@ -526,170 +1443,1833 @@ class SSDB(object):
             limit - Up to that many elements will be returned.
 
         return:
-            'ok' code if success,'data['index']' is key list,'data[items] is key-score pairs';other code failed
+            'ok' code if success,'data['index']' is key list,'data[items] is key-score pairs';other code failed;
+            data.columns() returns the keys and an array of the scores
         """
         return self.request("zrscan", [name, key_upper, score_upper, score_lower, limit])
 
-    def multi_zset(self, name, key_value_map):
+    def zrscan_iterator(self, name, key_upper='', score_upper='', score_lower='',
+                        page_size=None, page_bytes=256 * 1024, prefetch=None):
         """
-        Set multiple key-score pairs of a zset in one method call.
+        return a key-score tuple iterator over range (key_upper+score_upper, score_lower] of a zset
+        in reverse order.
 
         parameters:
-            name: zset name
-            key_value_map: key-score dict.
+            page_size:items fetched per request,None adapts it to page_bytes
+            page_bytes:target size of a page when page_size is None
+            prefetch:fetch the next page in the background while the current one is consumed,
+                None prefetches if the connection pool allows more than one connection
+        """
+        def fetch(start, limit):
+            return _zpairs_page(self.zrscan(name, start[0], start[1], score_lower, limit))
+        return self._range_iterator(fetch, (key_upper, score_upper), page_size, page_bytes, prefetch)
 
-        return:
-            return 'ok' code if success,other code failed
+    def zrank(self, name, key):
         """
-        l = [name]
-        for key, value in key_value_map.items():
-            l = l + [key, value]
-        return self.request("multi_zset", l)
+        Get the rank of a key in a zset,ordered by score ascending
+
+        parameters:
+            name:zset name
+            key:key
+
+        return:
+            'ok' code if success,'data' is the rank starting from 0;'not_found' code if key doesn't exist;
+            other code failed
+        """
+        return self.request("zrank", [name, key])
+
+    def zrrank(self, name, key):
+        """
+        Get the rank of a key in a zset,ordered by score descending
+
+        parameters:
+            name:zset name
+            key:key
+
+        return:
+            'ok' code if success,'data' is the rank starting from 0;'not_found' code if key doesn't exist;
+            other code failed
+        """
+        return self.request("zrrank", [name, key])
+
+    def zrange(self, name, offset, limit):
+        """
+        List key-score pairs of a zset by rank,ordered by score ascending
+
+        parameters:
+            name:zset name
+            offset:rank of the first pair
+            limit:up to that many pairs will be returned
+
+        return:
+            'ok' code if success,'data['index']' is keys list,'data[items] is key-score pairs';other code failed
+        """
+        return self.request("zrange", [name, offset, limit])
+
+    def zrrange(self, name, offset, limit):
+        """
+        List key-score pairs of a zset by rank,ordered by score descending
+
+        parameters:
+            name:zset name
+            offset:rank of the first pair
+            limit:up to that many pairs will be returned
+
+        return:
+            'ok' code if success,'data['index']' is keys list,'data[items] is key-score pairs';other code failed
+        """
+        return self.request("zrrange", [name, offset, limit])
+
+    def zcount(self, name, score_start, score_end):
+        """
+        Count the keys of a zset with score in [score_start,score_end]
+
+        parameters:
+            name:zset name
+            score_start:minimum score,empty string means -inf
+            score_end:maximum score,empty string means +inf
+
+        return:
+            'ok' code if success,'data' is the count;other code failed
+        """
+        return self.request("zcount", [name, score_start, score_end])
+
+    def zsum(self, name, score_start, score_end):
+        """
+        Sum the scores of a zset in [score_start,score_end]
+
+        parameters:
+            name:zset name
+            score_start:minimum score,empty string means -inf
+            score_end:maximum score,empty string means +inf
+
+        return:
+            'ok' code if success,'data' is the sum;other code failed
+        """
+        return self.request("zsum", [name, score_start, score_end])
+
+    def zavg(self, name, score_start, score_end):
+        """
+        Average the scores of a zset in [score_start,score_end]
+
+        parameters:
+            name:zset name
+            score_start:minimum score,empty string means -inf
+            score_end:maximum score,empty string means +inf
+
+        return:
+            'ok' code if success,'data' is the average as a float;other code failed
+        """
+        return self.request("zavg", [name, score_start, score_end])
+
+    def zremrangebyscore(self, name, score_start, score_end):
+        """
+        Delete the keys of a zset with score in [score_start,score_end]
+
+        parameters:
+            name:zset name
+            score_start:minimum score,empty string means -inf
+            score_end:maximum score,empty string means +inf
+
+        return:
+            'ok' code if success,'data' is the number of deleted keys;other code failed
+        """
+        return self.request("zremrangebyscore", [name, score_start, score_end])
+
+    def zremrangebyrank(self, name, start, end):
+        """
+        Delete the keys of a zset with rank in [start,end],ordered by score ascending
+
+        parameters:
+            name:zset name
+            start:first rank,starting from 0
+            end:last rank
+
+        return:
+            'ok' code if success,'data' is the number of deleted keys;other code failed
+        """
+        return self.request("zremrangebyrank", [name, start, end])
+
+    def multi_zset(self, name, key_value_map):
+        """
+        Set multiple key-score pairs of a zset in one method call.
+
+        parameters:
+            name: zset name
+            key_value_map: key-score dict.
+
+        return:
+            return 'ok' code if success,other code failed
+        """
+        l = [name]
+        l.extend(chain.from_iterable(key_value_map.iteritems()))
+        return self.request("multi_zset", l)
 
     def multi_zget(self, name, keys):
         """
         Get keys' score of a zset
 
-        parameters:
-            name:zset name
-            keys: key list
+        parameters:
+            name:zset name
+            keys: key list
+
+        return:
+            return 'ok' code if success,'data["index"]' key list,'data["items"]' is key-score pairs of 'data["index"]'
+            other code failed;
+            data.columns() returns the keys and an array of the scores
+        """
+        return self.request("multi_zget", [name] + keys)
+
+    def multi_zdel(self, name, keys):
+        """
+        Delete keys' score of a zset
+
+        parameters:
+            name:zset name
+            keys:key list
+
+        return:
+            return 'ok' code if success,other code failed
+        """
+        return self.request("multi_zdel", [name] + keys)
+
+    def qpush_back(self, name, items):
+        """
+        Push items to the back of a queue
+
+        parameters:
+            name:queue name
+            items:item list
+
+        return:
+            'ok' code if success,'data' is the queue size;other code failed
+        """
+        return self.request("qpush_back", [name] + map(self._encode, items))
+
+    def qpush_front(self, name, items):
+        """
+        Push items to the front of a queue one by one,the last item ends up first
+
+        parameters:
+            name:queue name
+            items:item list
+
+        return:
+            'ok' code if success,'data' is the queue size;other code failed
+        """
+        return self.request("qpush_front", [name] + map(self._encode, items))
+
+    def qpop_front(self, name, size=1):
+        """
+        Pop up to size items from the front of a queue
+
+        parameters:
+            name:queue name
+            size:max number of items
+
+        return:
+            'ok' code if success,'data' is the item list;
+            'not_found' code or an empty list if the queue is empty;other code failed
+        """
+        return self._decode(self.request("qpop_front", [name, size]))
+
+    def qpop_back(self, name, size=1):
+        """
+        Pop up to size items from the back of a queue,the last item comes first
+
+        parameters:
+            name:queue name
+            size:max number of items
+
+        return:
+            'ok' code if success,'data' is the item list;
+            'not_found' code or an empty list if the queue is empty;other code failed
+        """
+        return self._decode(self.request("qpop_back", [name, size]))
+
+    def qsize(self, name):
+        """
+        Get the size of a queue
+
+        parameters:
+            name:queue name
+
+        return:
+            'ok' code if success,'data' contain size;other code failed
+        """
+        return self.request("qsize", [name])
+
+    def qslice(self, name, begin, end):
+        """
+        List the items of a queue at positions [begin,end],negative positions count from the back
+
+        parameters:
+            name:queue name
+            begin:position of the first item
+            end:position of the last item
+
+        return:
+            'ok' code if success,'data' is the item list;other code failed
+        """
+        return self._decode(self.request("qslice", [name, begin, end]))
+
+    def qclear(self, name):
+        """
+        Delete all items of a queue
+
+        parameters:
+            name:queue name
+
+        return:
+            'ok' code if success,'data' is the number of deleted items;other code failed
+        """
+        return self.request("qclear", [name])
+
+    def queue_consumer(self, name, batch_size=100, prefetch=2, wait=None):
+        """
+        Return a QueueConsumer iterating the items popped from the front of a queue,see QueueConsumer
+        """
+        return QueueConsumer(self, name, batch_size, prefetch, wait)
+
+    def queue_producer(self, name, batch_size=100, max_bytes=1024 * 1024):
+        """
+        Return a QueueProducer pushing items to the back of a queue in batches,see QueueProducer
+        """
+        return QueueProducer(self, name, batch_size, max_bytes)
+
+    def pipeline(self, max_commands=1000, max_bytes=1024 * 1024):
+        """
+        Return a Pipeline that queues cmds and sends them in one round trip.
+
+        parameters:
+            max_commands:flush automatically when that many cmds are queued
+            max_bytes:flush automatically when the queued cmds reach that size
+        """
+        return Pipeline(self.connection_pool, max_commands, max_bytes, self.caches, self.codec)
+
+    def _read(self, cmd, name, key):
+        """
+        A get/hget/zget point read,merged with other threads' reads if coalescing is enabled
+        """
+        if self.bloom_filter is not None and cmd != "zget":
+            cache_key = ("get", key) if name is None else ("hget", name, key)
+            if not self.bloom_filter.might_exist(cache_key):
+                return SSDBResponse('not_found')
+        disk_cache = self.disk_cache if cmd == "get" else None
+        if disk_cache is not None:
+            value = disk_cache.get(key)
+            if value is not None:
+                return SSDBResponse('ok', value)
+            since = time.time()
+        if self.coalescer is not None:
+            resp = self.coalescer.read("multi_" + cmd, name, key)
+        else:
+            resp = self.request(cmd, [key] if name is None else [name, key])
+        if disk_cache is not None and resp.ok():
+            disk_cache.put(key, resp.data, since=since)
+        return resp
+
+    def _range_iterator(self, fetch, start, page_size, page_bytes, prefetch):
+        """
+        Iterate the items of the pages returned by fetch(start, limit)
+        """
+        if prefetch is None:
+            pool = getattr(self, 'connection_pool', None)
+            prefetch = pool is None or pool.max_connections is None or pool.max_connections > 1
+        pages = _range_pages(fetch, start, page_size, page_bytes)
+        if prefetch:
+            pages = _prefetched(pages)
+        return (item for page in pages for item in page)
+
+    def _parallel_range(self, fetch, sample, key_lower, key_upper, parts, boundaries, ordered,
+                        page_size, page_bytes, workers):
+        """
+        Fetch the pages of the sub-ranges of (key_lower,key_upper] with fetch(start, upper, limit)
+        """
+        if boundaries is None:
+            boundaries = sample(parts) if parts > 1 else []
+        boundaries = sorted(key for key in boundaries if key > key_lower and (key_upper == '' or key < key_upper))
+        bounds = [key_lower] + boundaries + [key_upper]
+        ranges = [_range_pages(lambda start, limit, upper=upper: fetch(start, upper, limit), lower,
+                               page_size, page_bytes) for lower, upper in izip(bounds, bounds[1:])]
+        if workers is None:
+            workers = len(ranges)
+            pool = getattr(self, 'connection_pool', None)
+            if pool is not None and pool.max_connections is not None:
+                workers = min(workers, pool.max_connections)
+        pages = _parallel_pages(ranges, workers, ordered)
+        if ordered:
+            return (item for page in pages for item in page)
+        return pages
+
+    @contextmanager
+    def use_master(self):
+        """
+        Send reads of the current thread to the master inside the with block
+
+        usage:
+            with ssdb.use_master():
+                ssdb.get('key')
+        """
+        if self.replica_router is None:
+            yield
+            return
+        self._local.master = getattr(self._local, 'master', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.master -= 1
+
+    def request(self, cmd, params=[]):
+        #decided in the calling thread,chunks may be sent by other threads
+        replica = self.replica_router is not None and not getattr(self._local, 'master', 0)
+        if self.chunk_keys is not None and cmd in multi_cmd_layouts:
+            chunks = _split_multi(params, multi_cmd_layouts[cmd], self.chunk_keys, self.chunk_bytes)
+            if len(chunks) > 1:
+                return self._chunked_request(cmd, params, chunks, replica)
+        return self._send(cmd, params, replica)
+
+    def _send(self, cmd, params, replica):
+        if self.metrics is not None:
+            return self.metrics.call(cmd, params, lambda cmd, params: self._request(cmd, params, replica))
+        return self._request(cmd, params, replica)
+
+    def _request(self, cmd, params, replica):
+        """
+        parameters:
+            replica:reads may be sent to a replica
+        """
+        try:
+            if self.multiplexer is not None:
+                return self.multiplexer.submit(cmd, params).result(self.socket_timeout)
+            if cmd not in read_cmd:
+                return self._pool_request(self.connection_pool, cmd, params)
+            if self.hedger is not None:
+                return self.hedger.call(lambda: self._read_request(cmd, params, replica),
+                                        lambda: self._pool_request(self.connection_pool, cmd, params))
+            return self._read_request(cmd, params, replica)
+        finally:
+            for cache in self.caches:
+                cache.invalidate_cmd(cmd, params)
+
+    def _chunked_request(self, cmd, params, chunks, replica):
+        """
+        Send the chunks of a multi_* cmd and merge their responses.
+
+        Chunks are sent in parallel only if the pool can wait for a free connection,
+        else they are pipelined on one connection so other threads' requests don't fail
+        for lack of connections.
+        """
+        if self.multiplexer is not None:
+            #pipelined on the shared connection
+            futures = [self.multiplexer.submit(cmd, chunk) for chunk in chunks]
+            try:
+                responses = [future.result(self.socket_timeout) for future in futures]
+            finally:
+                for chunk in chunks:
+                    for cache in self.caches:
+                        cache.invalidate_cmd(cmd, chunk)
+        else:
+            pool = self.connection_pool
+            workers = min(self.max_chunk_workers, len(chunks), pool.max_connections or self.max_chunk_workers)
+            if workers > 1 and (pool.max_connections is None or pool.timeout != 0):
+                with self._chunk_lock:
+                    if self._chunk_workers is None:
+                        self._chunk_workers = ThreadPool(self.max_chunk_workers)
+                responses = self._chunk_workers.map(lambda chunk: self._send(cmd, chunk, replica), chunks,
+                                                    chunksize=-(-len(chunks) // workers))
+            elif replica:
+                #one at a time so reads still go to the replicas
+                responses = [self._send(cmd, chunk, replica) for chunk in chunks]
+            elif self.metrics is not None:
+                return self.metrics.call(cmd, params, lambda cmd, params: self._pipelined_chunks(cmd, chunks))
+            else:
+                return self._pipelined_chunks(cmd, chunks)
+        return _merge_chunks(responses)
+
+    def _pipelined_chunks(self, cmd, chunks):
+        pipe = Pipeline(self.connection_pool, max_commands=len(chunks), caches=self.caches)
+        for chunk in chunks:
+            pipe.request(cmd, chunk)
+        return _merge_chunks(pipe.execute())
+
+    def _read_request(self, cmd, params, replica):
+        if replica:
+            resp = self._replica_request(cmd, params)
+            if resp is not None:
+                return resp
+        return self._pool_request(self.connection_pool, cmd, params)
+
+    def _replica_request(self, cmd, params):
+        """
+        Send a read to the fastest replica,None if it failed
+        """
+        router = self.replica_router
+        index = router.choose()
+        start = time.time()
+        try:
+            resp = self._pool_request(router.pools[index], cmd, params)
+        except ConnectionError:
+            router.failed(index)
+            return None
+        router.record(index, time.time() - start)
+        return resp
+
+    def _pool_request(self, pool, cmd, params):
+        connection = pool.get_connection()
+        try:
+            data = encode_cmd(cmd, params)
+            connection.send_cmd(data)
+            resp = connection.read_response()
+            if self.metrics is not None:
+                self.metrics.record_bytes(cmd, sum(len(chunk) for chunk in data), _reply_size(resp))
+
+            return self.parse_response(cmd, resp)
+        finally:
+            pool.release(connection)
+
+    def generate_cmd(self, data):
+        """
+        Generate ssdb cmd as one string, request() uses encode_cmd instead
+        """
+        params = []
+        [params.extend([str(len(str(item))), str(item)]) for item in data]
+        cmd = ('\n'.join(params) + '\n\n')
+        return cmd
+
+    def parse_response(self, cmd, resp):
+        """
+        解析返回的数据
+        """
+        if not resp:
+            return SSDBResponse('error', 'Unknown error')
+
+        if len(resp) == 0:
+            return SSDBResponse('disconnected', 'Connection closed')
+
+        parser = response_parsers.get(cmd)
+        if parser is None:
+            return None
+        return parser(resp)
+
+    def map_func(self, item):
+        if item[0] % 2 == 1:
+            return int(item[1])
+        return item[1]
+
+
+class ReplicaRouter(object):
+    """
+    Pick the replica with the lowest recent latency.
+
+    Latencies are tracked as exponentially weighted moving averages,
+    a small share of reads goes to a random replica so a replica
+    that was slow once gets measured again.
+
+    parameters:
+        pools:ConnectionPool of every replica
+        alpha:weight of a new latency sample
+        explore_rate:share of reads sent to a random replica
+        failure_penalty:latency in seconds recorded when a replica fails
+    """
+
+    def __init__(self, pools, alpha=0.2, explore_rate=0.05, failure_penalty=1.0):
+        self.pools = pools
+        self.alpha = alpha
+        self.explore_rate = explore_rate
+        self.failure_penalty = failure_penalty
+        self.latencies = [0.0] * len(pools)
+
+    def choose(self):
+        """
+        return:
+            index of the replica to read from
+        """
+        latencies = self.latencies
+        if len(latencies) > 1 and random.random() < self.explore_rate:
+            return random.randrange(len(latencies))
+        return min(xrange(len(latencies)), key=latencies.__getitem__)
+
+    def record(self, index, latency):
+        #a lost update between threads only drops one sample
+        self.latencies[index] += self.alpha * (latency - self.latencies[index])
+
+    def failed(self, index):
+        self.record(index, self.failure_penalty)
+
+
+def _split_multi(params, layout, max_keys, max_bytes):
+    """
+    Split the params of a multi_* cmd in chunks of at most max_keys keys and about max_bytes
+    """
+    prefix_size, width = layout
+    if len(params) - prefix_size <= max_keys * width and max_bytes is None:
+        return [params]
+    prefix = params[:prefix_size]
+    chunks = []
+    start = prefix_size
+    size = 0
+    for i in xrange(prefix_size, len(params), width):
+        item_size = sum(_sizeof(item) for item in params[i:i + width])
+        if i > start and (i - start >= max_keys * width or (max_bytes is not None and size + item_size > max_bytes)):
+            chunks.append(prefix + params[start:i])
+            start = i
+            size = 0
+        size += item_size
+    if not chunks:
+        return [params]
+    chunks.append(prefix + params[start:])
+    return chunks
+
+
+def _merge_chunks(responses):
+    """
+    One response of the responses of a multi_* cmd's chunks,the first failed one if any
+    """
+    for resp in responses:
+        if not resp.ok():
+            return resp
+    data = responses[0].data
+    if isinstance(data, ScanResult):
+        return SSDBResponse('ok', ScanResult.concat([resp.data for resp in responses]))
+    if isinstance(data, dict):
+        merged = {}
+        for resp in responses:
+            merged.update(resp.data)
+        return SSDBResponse('ok', merged)
+    return SSDBResponse('ok', sum(resp.data for resp in responses))
+
+
+def _check_page(resp):
+    if not resp.ok():
+        raise ResponseError(resp.code, resp.message)
+
+
+def _pairs_page(resp):
+    """
+    Page of a scan style response:(pairs,start of the next page,size)
+    """
+    _check_page(resp)
+    pairs = resp.data.pairs()
+    return pairs, pairs[-1][0] if pairs else None, sum(len(key) + _sizeof(value) for key, value in pairs)
+
+
+def _zpairs_page(resp):
+    _check_page(resp)
+    pairs = resp.data.pairs()
+    return pairs, pairs[-1] if pairs else None, sum(len(key) + 8 for key, score in pairs)
+
+
+def _list_page(resp):
+    _check_page(resp)
+    return resp.data, resp.data[-1] if resp.data else None, sum(len(key) for key in resp.data)
+
+
+#bounds of the adaptive page size
+min_page_size = 10
+max_page_size = 10000
+
+
+def _range_pages(fetch, start, page_size, page_bytes):
+    """
+    Pages of a range,each starting after the last item of the previous one.
+    Without page_size the limit is adapted so pages hold about page_bytes.
+    """
+    limit = page_size or 100
+    while True:
+        items, start, size = fetch(start, limit)
+        yield items
+        if len(items) < limit:
+            return
+        if page_size is None:
+            limit = max(min_page_size, min(max_page_size, page_bytes * len(items) // max(size, 1)))
+
+
+def _prefetched(pages):
+    """
+    Fetch pages on a background thread,one page ahead of the consumer
+    """
+    queue = Queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for page in pages:
+                if not _put(queue, (page, None), stop):
+                    return
+        except Exception, e:
+            _put(queue, (_end, e), stop)
+        else:
+            _put(queue, (_end, None), stop)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            page, error = queue.get()
+            if page is _end:
+                if error is not None:
+                    raise error
+                return
+            yield page
+    finally:
+        #the consumer may stop early
+        stop.set()
+
+
+#marks the last page of a range in the queues of background fetchers
+_end = object()
+
+
+def _put(queue, item, stop):
+    """
+    Put item in a bounded queue unless the consumer stopped
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, True, 0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+
+def _parallel_pages(ranges, workers, ordered):
+    """
+    Fetch the pages of many ranges on worker threads,each range by one worker.
+
+    parameters:
+        ranges:page iterators,e.g. from _range_pages
+        workers:number of threads
+        ordered:yield the pages of a range after all pages of the ranges before it,
+            otherwise pages are yielded as they arrive
+    """
+    stop = threading.Event()
+    todo = Queue.Queue()
+    #workers take ranges in order,so the range an ordered consumer waits for is always being fetched
+    for index, pages in enumerate(ranges):
+        todo.put((index, pages))
+    if ordered:
+        queues = [Queue.Queue(maxsize=2) for _ in ranges]
+    else:
+        queues = [Queue.Queue(maxsize=2 * workers)] * len(ranges)
+
+    def work():
+        while not stop.is_set():
+            try:
+                index, pages = todo.get_nowait()
+            except Queue.Empty:
+                return
+            queue = queues[index]
+            try:
+                for page in pages:
+                    if page and not _put(queue, (page, None), stop):
+                        return
+            except Exception, e:
+                _put(queue, (_end, e), stop)
+                return
+            if not _put(queue, (_end, None), stop):
+                return
+
+    for _ in xrange(max(1, min(workers, len(ranges)))):
+        worker = threading.Thread(target=work)
+        worker.daemon = True
+        worker.start()
+    try:
+        remaining = len(ranges)
+        for queue in (queues if ordered else queues[:1]):
+            while remaining:
+                page, error = queue.get()
+                if page is _end:
+                    if error is not None:
+                        raise error
+                    remaining -= 1
+                    if ordered:
+                        break
+                    continue
+                yield page
+    finally:
+        stop.set()
+
+
+def _interpolate(first, last, parts):
+    """
+    Keys splitting [first,last] in parts of equal span,comparing 8 bytes after their common prefix
+    """
+    prefix = os.path.commonprefix([first, last])
+    low, high = [struct.unpack('>Q', key[len(prefix):len(prefix) + 8].ljust(8, '\x00'))[0] for key in (first, last)]
+    return [prefix + struct.pack('>Q', low + (high - low) * i // parts) for i in xrange(1, parts)]
+
+
+def _sample_boundaries(next_key, last, key_lower, parts):
+    """
+    Keys splitting a range in up to parts sub-ranges,assuming keys are spread evenly
+    between its first and last key.
+
+    parameters:
+        next_key:function returning the first existing key after a key,None if there is none
+        last:last key of the range
+    """
+    first = next_key(key_lower)
+    if first is None or last is None or first >= last:
+        return []
+    boundaries = []
+    for probe in _interpolate(first, last, parts):
+        #moving probes to existing keys drops empty sub-ranges
+        key = next_key(probe)
+        if key is not None and key < last and (not boundaries or key > boundaries[-1]):
+            boundaries.append(key)
+    return boundaries
+
+
+class RequestHedger(object):
+    """
+    Hedge idempotent reads: if a read has not answered after a delay,
+    send a duplicate and use whichever answers first.
+
+    The delay is fixed,or if delay is None the given percentile of recently
+    observed latencies, so about (100 - percentile)% of reads are hedged.
+    The losing request still completes on its worker thread and its
+    connection is released to the pool as usual.
+
+    parameters:
+        delay:seconds to wait before hedging,None for the adaptive delay
+        percentile:latency percentile used as adaptive delay
+        window:number of recent latencies the percentile is computed from
+        workers:threads running the requests
+    """
+
+    #latencies needed before the adaptive delay hedges
+    min_samples = 20
+    #the adaptive delay is recomputed every that many latencies
+    update_interval = 100
+
+    def __init__(self, delay=None, percentile=95, window=1000, workers=16):
+        self.delay = delay
+        self.percentile = percentile
+        self.window = window
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        #guards the counters and latencies updated by caller and worker threads
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._samples = 0
+        self._adaptive_delay = None
+        self._workers = ThreadPool(workers)
+
+    def current_delay(self):
+        """
+        return:
+            seconds to wait before hedging,None means don't hedge
+        """
+        if self.delay is not None:
+            return self.delay
+        return self._adaptive_delay
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self._samples += 1
+            if self._samples % self.update_interval != 0 and self._samples != self.min_samples:
+                return
+            latencies = list(self._latencies)
+        latencies.sort()
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))
+        self._adaptive_delay = latencies[index]
+
+    def stats(self):
+        """
+        return:
+            dict of requests,hedges fired and hedges that answered first
+        """
+        with self._lock:
+            return {'requests': self.requests, 'fired': self.fired, 'won': self.won,
+                    'delay': self.current_delay()}
+
+    def call(self, primary, backup):
+        """
+        Run primary(),run backup() as well if primary is slow
+
+        return:
+            the result of the first to succeed
+        """
+        with self._lock:
+            self.requests += 1
+        results = Queue.Queue()
+        start = time.time()
+
+        def run(function, hedge):
+            try:
+                result = function()
+            except Exception, e:
+                results.put((hedge, None, e))
+                return
+            if not hedge:
+                self.record(time.time() - start)
+            results.put((hedge, result, None))
+
+        self._workers.apply_async(run, (primary, False))
+        delay = self.current_delay()
+        if delay is None:
+            hedge, result, error = results.get()
+        else:
+            try:
+                hedge, result, error = results.get(True, delay)
+            except Queue.Empty:
+                with self._lock:
+                    self.fired += 1
+                self._workers.apply_async(run, (backup, True))
+                hedge, result, error = results.get()
+                if error is not None:
+                    #the other request may still succeed
+                    hedge, result, error = results.get()
+                if hedge and error is None:
+                    with self._lock:
+                        self.won += 1
+        if error is not None:
+            raise error
+        return result
+
+    def close(self):
+        """
+        Stop the worker threads
+        """
+        self._workers.close()
+
+
+class _CoalescedBatch(object):
+    def __init__(self):
+        self.keys = []
+        self.key_set = set()
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class RequestCoalescer(object):
+    """
+    Merge point reads issued concurrently by many threads into one multi_* request.
+
+    The first thread reading from a (cmd, name) group becomes the leader:
+    it waits up to window seconds, or until max_batch keys were added by other threads,
+    sends the multi_* request and hands every waiting thread its own SSDBResponse.
+
+    parameters:
+        request:function sending a cmd, usually SSDB.request
+        window:seconds the leader waits for other reads
+        max_batch:max keys of a merged request
+    """
+
+    def __init__(self, request, window=0.0003, max_batch=64):
+        self._request = request
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def read(self, multi_cmd, name, key):
+        """
+        Read a key through a merged multi_cmd request
+
+        parameters:
+            multi_cmd:multi_get,multi_hget or multi_zget
+            name:hashmap or zset name,None for multi_get
+            key:key
+
+        return:
+            the same SSDBResponse as get/hget/zget
+        """
+        #responses are keyed by the str sent,so 5 and '5' are one key
+        key = encode_key(key)
+        if name is not None:
+            name = encode_key(name)
+        group = (multi_cmd, name)
+        with self._lock:
+            batch = self._batches.get(group)
+            leader = batch is None
+            if leader:
+                batch = self._batches[group] = _CoalescedBatch()
+            if key not in batch.key_set:
+                batch.key_set.add(key)
+                batch.keys.append(key)
+                if len(batch.keys) >= self.max_batch:
+                    del self._batches[group]
+                    batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batches.get(group) is batch:
+                    del self._batches[group]
+            try:
+                params = batch.keys if name is None else [name] + batch.keys
+                batch.response = self._request(multi_cmd, params)
+            except Exception, e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        resp = batch.response
+        if not resp.ok():
+            return SSDBResponse(resp.code, resp.message)
+        items = resp.data['items']
+        if key in items:
+            return SSDBResponse('ok', items[key])
+        return SSDBResponse('not_found')
+
+
+def _params_keys(params):
+    return [("get", key) for key in params]
+
+
+def _params_pairs_keys(params):
+    return [("get", key) for key in params[::2]]
+
+
+def _name_key(params):
+    return [("hget", params[0], params[1])]
+
+
+def _name_keys(params):
+    return [("hget", params[0], key) for key in params[1:]]
+
+
+def _name_pairs_keys(params):
+    return [("hget", params[0], key) for key in params[1::2]]
+
+
+#write cmd -> function returning the cache keys its params touch,
+#('hget', name) stands for all keys of a hashmap
+cache_invalidations = {
+    'set': lambda params: [("get", params[0])],
+    'setx': lambda params: [("get", params[0])],
+    'setnx': lambda params: [("get", params[0])],
+    'getset': lambda params: [("get", params[0])],
+    'expire': lambda params: [("get", params[0])],
+    'del': lambda params: [("get", params[0])],
+    'incr': lambda params: [("get", params[0])],
+    'decr': lambda params: [("get", params[0])],
+    'multi_set': _params_pairs_keys,
+    'multi_del': _params_keys,
+    'hset': _name_key,
+    'hdel': _name_key,
+    'hincr': _name_key,
+    'hdecr': _name_key,
+    'multi_hset': _name_pairs_keys,
+    'multi_hdel': _name_keys,
+    'hclear': lambda params: [("hget", params[0])],
+}
+
+
+def _reply_size(resp):
+    """
+    Size of a reply on the wire,each item is its length,a newline,the item and a newline
+    """
+    return sum(len(str(len(item))) + len(item) + 2 for item in resp) + 1
+
+
+def _sizeof(item):
+    if isinstance(item, tuple):
+        return sum(_sizeof(part) for part in item)
+    if isinstance(item, (str, unicode, bytearray, memoryview)):
+        return len(item)
+    return 8
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.stale = False
+
+
+class ReadCache(object):
+    """
+    In-process cache of get/hget responses.
+
+    Entries are evicted in LRU order once cached keys and values exceed max_bytes,
+    and expire after ttl seconds or the ttl given to SSDB.set().
+    Writes made through the same SSDB invalidate the entries they touch,
+    concurrent misses of a key are collapsed into one server fetch.
+
+    parameters:
+        max_bytes:bound on the size of cached keys and values
+        ttl:seconds an entry lives,None means until evicted or invalidated
+    """
+
+    #rough per entry overhead in bytes
+    entry_overhead = 100
+
+    def __init__(self, max_bytes=1024 * 1024 * 64, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+
+    def get(self, cache_key):
+        """
+        return:
+            the cached SSDBResponse of cache_key,None if not cached
+        """
+        with self._lock:
+            entry = self._entries.pop(cache_key, None)
+            if entry is None:
+                return None
+            code, data, size, expire_at = entry
+            if expire_at is not None and expire_at <= time.time():
+                self.size -= size
+                return None
+            #reinsert as most recently used
+            self._entries[cache_key] = entry
+            self.hits += 1
+        return SSDBResponse(code, data)
+
+    def put(self, cache_key, response, ttl=None):
+        """
+        Cache an 'ok' or 'not_found' response,ttl can only shorten the cache's ttl
+        """
+        with self._lock:
+            self._store(cache_key, response, ttl)
+
+    def _store(self, cache_key, response, ttl=None):
+        if response.code == 'ok':
+            data = response.data
+        elif response.code == 'not_found':
+            data = None
+        else:
+            return
+        size = self.entry_overhead + _sizeof(cache_key) + _sizeof(data)
+        if size > self.max_bytes:
+            return
+        if ttl is None or (self.ttl is not None and self.ttl < ttl):
+            ttl = self.ttl
+        expire_at = time.time() + ttl if ttl is not None else None
+
+        self._remove(cache_key)
+        self._entries[cache_key] = (response.code, data, size, expire_at)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, cache_key):
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def load(self, cache_key, loader, *args):
+        """
+        Return the cached response of cache_key,or call loader(*args) and cache its response.
+        Threads missing the same key at the same time share one loader call.
+        """
+        response = self.get(cache_key)
+        if response is not None:
+            return response
+
+        with self._lock:
+            flight = self._flights.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[cache_key] = _Flight()
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            response = flight.response
+            return SSDBResponse(response.code, response.data if response.ok() else response.message)
+
+        try:
+            flight.response = loader(*args)
+        except Exception, e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.response is not None and not flight.stale:
+                    self._store(cache_key, flight.response)
+                del self._flights[cache_key]
+            flight.done.set()
+        return flight.response
+
+    def invalidate(self, cache_key):
+        with self._lock:
+            if cache_key[0] == "hget" and len(cache_key) == 2:
+                cache_keys = set(key for key in chain(self._entries, self._flights) if key[:2] == cache_key)
+            else:
+                cache_keys = [cache_key]
+            for cache_key in cache_keys:
+                self._remove(cache_key)
+                flight = self._flights.get(cache_key)
+                if flight is not None:
+                    #the value being loaded may predate the write
+                    flight.stale = True
+
+    def invalidate_cmd(self, cmd, params):
+        """
+        Invalidate the entries touched by a write cmd
+        """
+        keys = cache_invalidations.get(cmd)
+        if keys is not None:
+            for cache_key in keys(params):
+                #entries are keyed by the str sent,so 5 and '5' are one key
+                self.invalidate((cache_key[0],) + tuple(imap(encode_key, cache_key[1:])))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            for flight in self._flights.itervalues():
+                flight.stale = True
+
+
+class MultiplexedConnection(object):
+    """
+    One connection shared by many threads.
+
+    ssdb answers the requests of a connection in order, so requests of all threads
+    are written to the same socket and a reader thread hands each response
+    to the Future of the request it belongs to.
+
+    parameters:
+        host:host to connect
+        port:port to connect
+        parse_response:function turning (cmd, response list) into a SSDBResponse
+        memoryview_threshold:see Connection
+    """
 
-        return:
-            return 'ok' code if success,'data["index"]' key list,'data["items"]' is key-score pairs of 'data["index"]'
-            other code failed
-        """
-        return self.request("multi_zget", [name] + keys)
+    def __init__(self, host, port, parse_response, memoryview_threshold=None):
+        self.host = host
+        self.port = port
+        self.parse_response = parse_response
+        self.memoryview_threshold = memoryview_threshold
+        #guards the connection and pending,held briefly so the reader is never blocked by a send
+        self._lock = threading.Lock()
+        #keeps the order of pending the order requests are written in
+        self._send_lock = threading.Lock()
+        self._connection = None
+        self._socket = None
+        self._pending = None
 
-    def multi_zdel(self, name, keys):
+    def submit(self, cmd, params=[]):
         """
-        Delete keys' score of a zset
-
-        parameters:
-            name:zset name
-            keys:key list
+        Send a cmd
 
         return:
-            return 'ok' code if success,other code failed
+            a Future of the cmd's SSDBResponse
+        """
+        chunks = encode_cmd(cmd, params)
+        future = Future()
+        with self._send_lock:
+            with self._lock:
+                if self._connection is None:
+                    self._open()
+                connection, sock, pending = self._connection, self._socket, self._pending
+                pending.append((cmd, future))
+            try:
+                connection.send_cmd(chunks)
+                return future
+            except ConnectionError, e:
+                error = e
+                with self._lock:
+                    #don't let other threads reconnect this connection without a reader
+                    if self._connection is connection:
+                        self._connection, self._socket, self._pending = None, None, None
+        self._fail(connection, sock, pending, error)
+        return future
+
+    def _open(self):
+        #the reader blocks while no request is in flight, so no socket timeout
+        connection = Connection(self.host, self.port, None, self.memoryview_threshold)
+        connection.connect()
+        self._connection, self._socket, self._pending = connection, connection.socket, deque()
+        reader = threading.Thread(target=self._read_loop, args=(connection, connection.socket, self._pending))
+        reader.daemon = True
+        reader.start()
+
+    def _read_loop(self, connection, sock, pending):
+        while True:
+            try:
+                resp = connection.read_response()
+            except Exception, e:
+                self._fail(connection, sock, pending, e)
+                return
+            with self._lock:
+                if not pending:
+                    break
+                cmd, future = pending.popleft()
+            try:
+                future.set_result(self.parse_response(cmd, resp))
+            except Exception, e:
+                future.set_exception(e)
+        self._fail(connection, sock, pending, ConnectionError("Unexpected response from server"))
+
+    def _fail(self, connection, sock, pending, error):
+        with self._lock:
+            if self._connection is connection:
+                self._connection, self._socket, self._pending = None, None, None
+            failed = list(pending)
+            pending.clear()
+        try:
+            #wake up the reader blocked on recv
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        connection.dis_connect()
+        if not isinstance(error, ConnectionError):
+            error = ConnectionError(error)
+        for cmd, future in failed:
+            future.set_exception(error)
+
+    def close(self):
         """
-        return self.request("multi_zdel", [name] + keys)
+        Close the connection,requests waiting for a response fail with ConnectionError
+        """
+        with self._lock:
+            connection, sock, pending = self._connection, self._socket, self._pending
+        if connection is not None:
+            self._fail(connection, sock, pending, ConnectionError("Connection closed"))
+
+
+class _FutureClient(SSDB):
+    """
+    SSDB whose methods return the Future of their request
+    """
+
+    def __init__(self, multiplexer, caches=(), codec=None):
+        self.multiplexer = multiplexer
+        self.caches = caches
+        self.codec = codec
 
     def request(self, cmd, params=[]):
-        connection = self.connection_pool.get_connection()
+        future = self.multiplexer.submit(cmd, params)
+        for cache in self.caches:
+            future.add_done_callback(lambda f, cache=cache: cache.invalidate_cmd(cmd, params))
+        return future
+
+
+def _then(future, function):
+    """
+    A Future of function applied to the result of future
+    """
+    chained = Future()
+
+    def done(future):
         try:
-            params = [cmd] + params
-            connection.send_cmd(self.generate_cmd(params))
-            resp = connection.read_response()
+            chained.set_result(function(future.result()))
+        except Exception, e:
+            chained.set_exception(e)
+    future.add_done_callback(done)
+    return chained
 
-            return self.parse_response(cmd, resp)
+
+def _join_chunks(chunks):
+    """
+    Join runs of small chunks so they are sent with one sendall
+    """
+    joined = []
+    small = []
+    for chunk in chunks:
+        if len(chunk) >= send_join_threshold:
+            if small:
+                joined.append(''.join(small))
+                small = []
+            joined.append(chunk)
+        else:
+            small.append(chunk)
+    if small:
+        joined.append(''.join(small))
+    return joined
+
+
+class Pipeline(SSDB):
+    """
+    Queue cmds and send them to ssdb in one round trip.
+
+    Methods are the same as SSDB's but return the pipeline itself,
+    execute() sends the queued cmds and returns their SSDBResponse list in order.
+    Queued cmds are flushed automatically when max_commands or max_bytes is reached,
+    their responses are kept until the next execute().
+
+    usage:
+        with ssdb.pipeline() as pipe:
+            pipe.set('a', 1).hset('h', 'k', 'v')
+            responses = pipe.execute()
+
+    parameters:
+        connection_pool:pool to take the connection from
+        max_commands:flush when that many cmds are queued
+        max_bytes:flush when the queued cmds reach that size
+        caches:caches to invalidate on writes
+        codec:see SSDB,request() sends params as given
+    """
+
+    def __init__(self, connection_pool, max_commands=1000, max_bytes=1024 * 1024, caches=(), codec=None):
+        self.connection_pool = connection_pool
+        self.max_commands = max_commands
+        self.max_bytes = max_bytes
+        self.caches = caches
+        self.codec = codec
+        #positions in the responses of cmds whose values are decoded
+        self._decoded = []
+        self._commands = []
+        self._params = []
+        self._chunks = []
+        self._bytes = 0
+        self._responses = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self.reset()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def _decode(self, resp):
+        if resp is self and self.codec is not None:
+            #decoded by execute(),the cmd just queued may have been flushed already
+            self._decoded.append(len(self._responses) + len(self._commands) - 1)
+        return resp
+
+    def request(self, cmd, params=[]):
+        chunks = encode_cmd(cmd, params)
+        self._commands.append(cmd)
+        if self.caches:
+            self._params.append(params)
+        self._chunks.extend(chunks)
+        self._bytes += sum(len(chunk) for chunk in chunks)
+        if len(self._commands) >= self.max_commands or self._bytes >= self.max_bytes:
+            self.flush()
+        return self
+
+    def flush(self):
+        """
+        Send the queued cmds and read their responses
+        """
+        if not self._commands:
+            return
+        commands, params, chunks = self._commands, self._params, self._chunks
+        self._commands, self._params, self._chunks, self._bytes = [], [], [], 0
+
+        connection = self.connection_pool.get_connection()
+        try:
+            connection.send_cmd(_join_chunks(chunks))
+            for cmd in commands:
+                resp = connection.read_response()
+                self._responses.append(self.parse_response(cmd, resp))
+        except:
+            #unread responses are left on the socket
+            connection.dis_connect()
+            raise
         finally:
             self.connection_pool.release(connection)
+            for cache in self.caches:
+                for cmd, cmd_params in izip(commands, params):
+                    cache.invalidate_cmd(cmd, cmd_params)
 
-    def generate_cmd(self, data):
+    def execute(self):
         """
-        Generate ssdb cmd
+        Flush the queued cmds
+
+        return:
+            SSDBResponse list of all cmds queued since the last execute(),in order
         """
-        params = []
-        [params.extend([str(len(str(item))), str(item)]) for item in data]
-        cmd = ('\n'.join(params) + '\n\n')
-        return cmd
+        self.flush()
+        responses = self._responses
+        for index in self._decoded:
+            responses[index] = SSDB._decode(self, responses[index])
+        self._responses, self._decoded = [], []
+        return responses
 
-    def parse_response(self, cmd, resp):
+    def reset(self):
         """
-        解析返回的数据
+        Drop queued cmds and responses not returned yet
         """
-        if not resp:
-            return SSDBResponse('error', 'Unknown error')
+        self._commands, self._params, self._chunks, self._bytes = [], [], [], 0
+        self._responses, self._decoded = [], []
 
-        if len(resp) == 0:
-            return SSDBResponse('disconnected', 'Connection closed')
 
-        #
-        if cmd in update_cmd:
-            if len(resp) > 1:
-                return SSDBResponse(resp[0], int(resp[1]))
-            else:
-                return SSDBResponse(resp[0], 1)
+class QueueConsumer(object):
+    """
+    Iterate the items popped from the front of a queue.
 
-        if cmd in single_get_cmd:
-            if resp[0] == 'ok':
-                if len(resp) == 2:
-                    return SSDBResponse('ok', resp[1])
-                else:
-                    return SSDBResponse('server_error', 'Invalid response')
-            else:
-                return SSDBResponse(resp[0])
-
-        if cmd in incr_cmd:
-            if resp[0] == 'ok':
-                if len(resp) == 2:
-                    try:
-                        val = int(resp[1])
-                        return SSDBResponse('ok', val)
-                    except Exception, e:
-                        return SSDBResponse('server_error', 'Invalid response')
-                else:
-                    return SSDBResponse('server_error', 'Invalid response')
-            else:
-                return SSDBResponse(resp[0])
-
-        if cmd in key_cmd:
-            if resp[0] == 'ok':
-                return SSDBResponse(resp[0], [] + resp[1:])
-
-        if cmd in scan_key:
-            if resp[0] == 'ok':
-                if len(resp) % 2 == 1:
-                    #返回一个iterator
-                    iterator = iter(resp[1:])
-                    #生成items
-                    iz = tuple(izip(iterator, iterator))
-                    index = [item[0] for item in iz]
-                    items = dict(iz)
-                    data = {'index': index, 'items': items}
-                    return SSDBResponse('ok', data)
-                else:
-                    return SSDBResponse('server_error', 'Invalid response')
-            else:
-                return SSDBResponse(resp[0])
-
-        if cmd in zscan_key:
-            if resp[0] == 'ok':
-                if len(resp) % 2 == 1:
-                    #将score int化
-                    format_resp = map(lambda item: self.map_func(item), enumerate(resp[1:]))
-
-                    #返回一个iterator
-                    iterator = iter(format_resp)
-                    #生成items
-                    iz = tuple(izip(iterator, iterator))
-                    index = [item[0] for item in iz]
-                    items = dict(iz)
-                    data = {'index': index, 'items': items}
-                    return SSDBResponse('ok', data)
+    Batches of items are popped by a background thread ahead of the consumer.
+    close() pushes the popped but unconsumed items back to the front of the queue,
+    they are lost if the process dies first.
+
+    usage:
+        with ssdb.queue_consumer('queue') as consumer:
+            for item in consumer:
+                handle(item)
+
+    parameters:
+        client:SSDB popping the items
+        name:queue name
+        batch_size:items popped per request
+        prefetch:batches popped ahead of the consumer
+        wait:seconds to wait before polling an empty queue again,None stops at the first empty poll
+    """
+
+    def __init__(self, client, name, batch_size=100, prefetch=2, wait=None):
+        self.client = client
+        self.name = name
+        self.batch_size = batch_size
+        self.wait = wait
+        self._batches = Queue.Queue(maxsize=max(1, prefetch))
+        self._items = deque()
+        self._stop = threading.Event()
+        self._unqueued = []
+        self._thread = None
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while not self._items:
+            if self._done:
+                raise StopIteration
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._pop)
+                self._thread.daemon = True
+                self._thread.start()
+            batch, error = self._batches.get()
+            if batch is _end:
+                self._done = True
+                if error is not None:
+                    raise error
+                raise StopIteration
+            self._items.extend(batch)
+        return self._items.popleft()
+
+    def _pop(self):
+        stop = self._stop
+        try:
+            while not stop.is_set():
+                resp = self.client.qpop_front(self.name, self.batch_size)
+                if resp.ok() and resp.data:
+                    if not _put(self._batches, (resp.data, None), stop):
+                        #closed while waiting for the consumer
+                        self._unqueued.extend(resp.data)
+                        return
+                elif not (resp.ok() or resp.not_found()):
+                    _put(self._batches, (_end, ResponseError(resp.code, resp.message)), stop)
+                    return
+                elif self.wait is None:
+                    break
                 else:
-                    return SSDBResponse('server_error', 'Invalid response')
-            else:
-                return SSDBResponse(resp[0])
-        return None
+                    stop.wait(self.wait)
+        except Exception, e:
+            _put(self._batches, (_end, e), stop)
+        else:
+            _put(self._batches, (_end, None), stop)
 
-    def map_func(self, item):
-        if item[0] % 2 == 1:
-            return int(item[1])
-        return item[1]
+    def close(self):
+        """
+        Stop popping and push the unconsumed items back to the front of the queue
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        items = list(self._items)
+        while True:
+            try:
+                batch, error = self._batches.get_nowait()
+            except Queue.Empty:
+                break
+            if batch is not _end:
+                items.extend(batch)
+        items.extend(self._unqueued)
+        self._items.clear()
+        self._unqueued = []
+        self._done = True
+        if items:
+            #pushed one by one to the front,so the first item is pushed last
+            self.client.qpush_front(self.name, items[::-1])
+
+
+class QueueProducer(object):
+    """
+    Push items to the back of a queue in batches.
+
+    Items are buffered and pushed with one qpush_back once batch_size items or max_bytes
+    are buffered,flush() pushes the buffered items at once.
+    Safe to share between threads.
+
+    usage:
+        with ssdb.queue_producer('queue') as producer:
+            for item in items:
+                producer.put(item)
+
+    parameters:
+        client:SSDB pushing the items
+        name:queue name
+        batch_size:push when that many items are buffered
+        max_bytes:push when the buffered items reach that size
+    """
+
+    def __init__(self, client, name, batch_size=100, max_bytes=1024 * 1024):
+        self.client = client
+        self.name = name
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self._items = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._lock:
+            self._items.append(item)
+            self._bytes += _sizeof(item)
+            if len(self._items) >= self.batch_size or self._bytes >= self.max_bytes:
+                self._flush()
+
+    def flush(self):
+        """
+        Push the buffered items,failed pushes raise ResponseError and keep the items buffered
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._items:
+            return
+        resp = self.client.qpush_back(self.name, self._items)
+        if not resp.ok():
+            raise ResponseError(resp.code, resp.message)
+        self._items = []
+        self._bytes = 0
+
+    close = flush
 
 
 class ConnectionError(Exception):
     pass
 
 
+class ResponseError(Exception):
+    """
+    A cmd failed,args are the response code and message
+    """
+    pass
+
+
+class ResponseParser(object):
+    """
+    Incremental parser of ssdb responses, independent of any socket.
+
+    Data is received straight into the parser's buffer: get_buffer() returns
+    a writable memoryview, buffer_updated() tells how many bytes were written
+    (the interface of asyncio's BufferedProtocol), gets() returns the next
+    complete response. Parsing resumes where the previous call stopped,
+    so every received byte is scanned once.
+
+    parameters:
+        memoryview_threshold:values at least that many bytes long are returned
+            as memoryview slices of the read buffer instead of str copies,
+            None means always return str
+    """
+
+    #initial size of the read buffer
+    buffer_size = 1024 * 16
+    #buffers grown beyond this are dropped after a complete response
+    max_idle_buffer_size = 1024 * 1024
+
+    def __init__(self, memoryview_threshold=None):
+        self.memoryview_threshold = memoryview_threshold
+        self.reset()
+
+    def reset(self):
+        #buf[buf_start:buf_end] holds received data not yet consumed
+        self.buf = bytearray(self.buffer_size)
+        self.buf_start = 0
+        self.buf_end = 0
+        #state of the response being parsed
+        self._parse_index = 0
+        self._parse_items = []
+        #a value slice handed out as memoryview pins the buffer
+        self._buf_exported = False
+
+    def get_buffer(self, size_hint=0):
+        """
+        Return a writable memoryview of at least size_hint bytes for incoming data
+        """
+        self._reserve(max(size_hint, 1024 * 8))
+        return memoryview(self.buf)[self.buf_end:]
+
+    def buffer_updated(self, nbytes):
+        """
+        nbytes were written to the memoryview returned by get_buffer()
+        """
+        self.buf_end += nbytes
+
+    def feed(self, data):
+        """
+        Append received data
+        """
+        size = len(data)
+        self._reserve(size)
+        self.buf[self.buf_end:self.buf_end + size] = data
+        self.buf_end += size
+
+    def has_pending(self):
+        """
+        True if received data or a partial response has not been consumed
+        """
+        return self.buf_end > self.buf_start or bool(self._parse_items)
+
+    def _reserve(self, size):
+        """
+        Make room for at least size more bytes after buf_end
+        """
+        if len(self.buf) - self.buf_end >= size:
+            return
+        pending = self.buf_end - self.buf_start
+        capacity = len(self.buf)
+        while capacity - pending < size:
+            capacity *= 2
+        if self._buf_exported or capacity != len(self.buf):
+            #move pending data to a fresh buffer, leave exported slices alone
+            buf = bytearray(capacity)
+            buf[:pending] = self.buf[self.buf_start:self.buf_end]
+            self.buf = buf
+            self._buf_exported = False
+        else:
+            #compact in place
+            self.buf[:pending] = self.buf[self.buf_start:self.buf_end]
+        self._parse_index -= self.buf_start
+        self.buf_start = 0
+        self.buf_end = pending
+
+    def gets(self):
+        r"""
+        读取返回的数据,ssdb协议的返回格式
+        'len
+        data
+        len
+        data
+        ..
+        \n(最后是空行)
+         '
+
+        Returns the list of values of a complete response,
+        or None if more data is needed.
+        """
+        buf = self.buf
+        end = self.buf_end
+        read_index = self._parse_index
+        threshold = self.memoryview_threshold
+        view = None
+        while True:
+            index = buf.find('\n', read_index, end)
+
+            if index == -1:
+                break
+
+            #空行(或只有\r)表示一个response结束
+            if index == read_index or (index == read_index + 1 and buf[read_index] == 13):
+                ret = self._parse_items
+                self._parse_items = []
+                self.buf_start = self._parse_index = index + 1
+                if self.buf_start == self.buf_end:
+                    self._consumed()
+                return ret
+            try:
+                #接下来读取的字节数目
+                num = int(buf[read_index: index])
+            except ValueError:
+                raise ConnectionError("Invalid response from server")
+
+            data_end = index + 1 + num
+            #数据没有读够(包括末尾的换行)，继续读，再来处理
+            if data_end >= end:
+                if data_end >= len(buf):
+                    #grow once for a large value instead of doubling per recv
+                    self._parse_index = read_index
+                    self._reserve(data_end + 1 - end)
+                    return None
+                break
+
+            #the response code is always a str
+            if threshold is not None and num >= threshold and self._parse_items:
+                if view is None:
+                    view = memoryview(buf)
+                self._parse_items.append(view[index + 1: data_end])
+                self._buf_exported = True
+            else:
+                self._parse_items.append(str(buf[index + 1: data_end]))
+            #skip数据末尾的换行
+            read_index = data_end + 1
+
+        self._parse_index = read_index
+        return None
+
+    def _consumed(self):
+        """
+        All received data has been parsed, rewind or drop the buffer
+        """
+        if self._buf_exported or len(self.buf) > self.max_idle_buffer_size:
+            self.buf = bytearray(self.buffer_size)
+            self._buf_exported = False
+        self.buf_start = 0
+        self.buf_end = 0
+        self._parse_index = 0
+
+
 class Connection(object):
-    def __init__(self, host='127.0.0.1', port=8888, socket_timeout=None):
+    """
+    A connection to ssdb server
+
+    parameters:
+        host:host to connect
+        port:port to connect
+        socket_timeout:socket_timeout to set
+        memoryview_threshold:values at least that many bytes long are returned
+            as memoryview slices of the read buffer instead of str copies,
+            None means always return str
+    """
+
+    def __init__(self, host='127.0.0.1', port=8888, socket_timeout=None, memoryview_threshold=None):
         self.host = host
         self.port = port
         self.socket_timeout = socket_timeout
         self.socket = None
-        self.buf = ''
         self.pid = os.getpid()
+        self.parser = ResponseParser(memoryview_threshold)
+        self.last_used = time.time()
 
     def connect(self):
         if self.socket:
@@ -701,6 +3281,8 @@ class Connection(object):
 
     def _connect(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        #a cmd may be written with several sends, don't let nagle delay its tail
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         sock.settimeout(self.socket_timeout)
         sock.connect((self.host, self.port))
         return sock
@@ -713,14 +3295,21 @@ class Connection(object):
             pass
         finally:
             self.socket = None
-            self.buf = ''
+            self.parser.reset()
 
     def send_cmd(self, cmd):
+        """
+        Send a cmd, either a string or a list of chunks from encode_cmd
+        """
         if not self.socket:
             #don't need close if failed
             self.socket = self._connect()
         try:
-            self.socket.sendall(cmd)
+            if isinstance(cmd, list):
+                for chunk in cmd:
+                    self.socket.sendall(chunk)
+            else:
+                self.socket.sendall(cmd)
         except Exception, e:
             self.dis_connect()
             raise ConnectionError("error when write to socket:%s" % e)
@@ -729,107 +3318,194 @@ class Connection(object):
         while True:
             ret = self.parse()
 
-            if not ret:
+            if ret is None:
                 self._read_response()
             else:
                 return ret
 
     def _read_response(self):
+        view = self.parser.get_buffer()
         try:
-            data = self.socket.recv(1024 * 8)
+            num = self.socket.recv_into(view)
         except Exception, e:
             self.dis_connect()
             raise ConnectionError("error when recv from socket:%s" % e)
-        self.buf += data
+        finally:
+            del view
+        if num == 0:
+            self.dis_connect()
+            raise ConnectionError("Connection closed by server")
+        self.parser.buffer_updated(num)
 
-    def parse(self):
-        r"""
-        读取返回的数据,ssdb协议的返回格式
-        'len
-        data
-        len
-        data
-        ..
-        \n(最后是空行)
-         '
+    def can_read(self):
         """
-        ret = []
-        read_index = 0
-        while True:
-            index = self.buf.find('\n', read_index)
-
-            if index == -1:
-                break
-
-            #读取一行，len，表示下一次读取多少字节
-            line = self.buf[read_index: index]
-            #设置下一次的读取位置
-            read_index = index + 1
+        True if data or EOF can be read from the socket without blocking
+        """
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(self.socket, select.POLLIN)
+            return bool(poller.poll(0))
+        return bool(select.select([self.socket], [], [], 0)[0])
 
-            #可能是处理完一次response?
-            if line.strip() == '':
-                #复制余下的buf
-                self.buf = self.buf[read_index:]
-                return ret
-            try:
-                #接下来读取的字节数目
-                num = int(line)
-            except Exception, e:
-                return []
-            read_index = (read_index + num)
+    def ping(self):
+        """
+        True if the server answers a ping
+        """
+        self.send_cmd(encode_cmd('ping', []))
+        resp = self.read_response()
+        return bool(resp) and resp[0] == 'ok'
 
-            #数据没有读够，继续读，再来处理
-            if read_index > len(self.buf):
-                break
-                #读取的data
-            data = self.buf[index + 1: read_index]
+    def parse(self):
+        """
+        Return the next complete response from the received data, None if more data is needed
+        """
+        try:
+            return self.parser.gets()
+        except ConnectionError:
+            self.dis_connect()
+            raise
 
-            ret.append(data)
 
-            #skip数据末尾的换行
-            index = self.buf.find('\n', read_index)
+class ConnectionPool(object):
+    """
+    A thread safe pool of connections to ssdb server.
 
-            #继续搞
-            if index == - 1:
-                break
-            read_index += 1
+    Connections are reused in LIFO order, so the least recently used ones
+    stay idle at the bottom of the pool and can be reaped.
 
-        return None
+    parameters:
+        host:host to connect
+        port:port to connect
+        socket_timeout:socket_timeout to set
+        max_connections:max connection count,None means no limit
+        memoryview_threshold:see Connection
+        timeout:seconds get_connection() waits for a connection when max_connections are in use,
+            0 means raise ConnectionError at once,None means wait forever
+        idle_timeout:connections unused for that many seconds are closed,None means never
+        check_on_checkout:ping reused connections before handing them out
+
+    A ClientMetrics set with metrics.watch_pool(pool) records the time get_connection() takes.
+    """
 
+    metrics = None
 
-class ConnectionPool(object):
-    def __init__(self, host='127.0.0.1', port=8888, socket_timeout=None, max_connections=None):
-        self.pid = os.getpid()
+    def __init__(self, host='127.0.0.1', port=8888, socket_timeout=None, max_connections=None,
+                 memoryview_threshold=None, timeout=0, idle_timeout=None, check_on_checkout=False):
         self.host = host
         self.port = port
         self.socket_timeout = socket_timeout
         self.max_connections = max_connections
+        self.memoryview_threshold = memoryview_threshold
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.check_on_checkout = check_on_checkout
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self._lock = threading.Condition()
         self._created_connections = 0
         self._available_connections = []
         self._in_use_connections = set()
 
     def get_connection(self):
         self._check_pid()
+        if self.metrics is not None:
+            start = time.time()
+        while True:
+            connection, reused = self._acquire()
+            if not reused or self._is_healthy(connection):
+                if self.metrics is not None:
+                    self.metrics.record_checkout(self, time.time() - start, len(self._in_use_connections))
+                return connection
+            self._discard(connection)
+
+    def _acquire(self):
+        """
+        Pop an available connection or create a new one, waiting if max_connections are in use
+        """
+        deadline = None
+        if self.timeout:
+            deadline = time.time() + self.timeout
+        with self._lock:
+            self._reap_idle()
+            while True:
+                if self._available_connections:
+                    connection = self._available_connections.pop()
+                    self._in_use_connections.add(connection)
+                    return connection, True
+                if self.max_connections is None or self._created_connections < self.max_connections:
+                    self._created_connections += 1
+                    break
+                if deadline is None:
+                    if self.timeout == 0:
+                        raise ConnectionError("Too many connections")
+                    self._lock.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise ConnectionError("Too many connections")
+                    self._lock.wait(remaining)
+
         try:
-            connection = self._available_connections.pop()
-        except IndexError:
-            connection = self.new_connection();
-        self._in_use_connections.add(connection)
-        return connection
+            connection = self.new_connection()
+        except:
+            with self._lock:
+                self._created_connections -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._in_use_connections.add(connection)
+        return connection, False
+
+    def _is_healthy(self, connection):
+        #an idle connection has nothing to read unless the server closed it
+        if connection.socket is None or connection.can_read():
+            return False
+        if self.check_on_checkout:
+            try:
+                return connection.ping()
+            except ConnectionError:
+                return False
+        return True
 
     def release(self, connection):
         self._check_pid()
         #use this check if the connection belong to this pool
-        if self.pid == connection.pid:
-            self._in_use_connections.remove(connection)
-            self._available_connections.append(connection)
-
+        if self.pid != connection.pid:
+            return
+        if connection.parser.has_pending():
+            #interrupted in the middle of a response
+            connection.dis_connect()
+        if connection.socket is None:
+            self._discard(connection)
+            return
+        connection.last_used = time.time()
+        with self._lock:
+            if connection in self._in_use_connections:
+                self._in_use_connections.remove(connection)
+                self._available_connections.append(connection)
+                self._lock.notify()
+
+    def _discard(self, connection):
+        connection.dis_connect()
+        with self._lock:
+            if connection in self._in_use_connections:
+                self._in_use_connections.remove(connection)
+                self._created_connections -= 1
+                self._lock.notify()
+
+    def _reap_idle(self):
+        if self.idle_timeout is None:
+            return
+        expire = time.time() - self.idle_timeout
+        available = self._available_connections
+        while available and available[0].last_used <= expire:
+            available.pop(0).dis_connect()
+            self._created_connections -= 1
 
     def new_connection(self):
-        if self._created_connections >= self.max_connections:
-            raise ConnectionError("Too many connections")
-        self._created_connections += 1
-        connection = Connection(self.host, self.port, self.socket_timeout)
+        connection = Connection(self.host, self.port, self.socket_timeout, self.memoryview_threshold)
         connection.connect()
         return connection
 
@@ -842,4 +3518,4 @@ class ConnectionPool(object):
     def _check_pid(self):
         if self.pid != os.getpid():
             self._close_pool()
-            self.__init__(self, self.host, self.port, self.socket_timeout, self.max_connections)
\ No newline at end of file
+            self._reset()
@@ -0,0 +1,119 @@
+# encoding=utf-8
+"""
+Value codecs serializing values on write and deserializing them on read
+"""
+
+import cPickle
+import json
+import struct
+import zlib
+
+from ssdb.client import encode_value
+
+
+def _bytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+class RawCodec(object):
+    """
+    Values are sent as str(value) and read back as str,as without a codec
+    """
+
+    def encode(self, value):
+        return encode_value(value)
+
+    def decode(self, data):
+        return data
+
+
+class JSONCodec(object):
+    """
+    Values are sent as JSON
+    """
+
+    def encode(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def decode(self, data):
+        return json.loads(_bytes(data))
+
+
+class PickleCodec(object):
+    """
+    Values are sent pickled,only read values written by trusted clients
+
+    parameters:
+        protocol:pickle protocol
+    """
+
+    def __init__(self, protocol=cPickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def encode(self, value):
+        return cPickle.dumps(value, self.protocol)
+
+    def decode(self, data):
+        return cPickle.loads(_bytes(data))
+
+
+class StructCodec(object):
+    """
+    Numbers are sent packed with struct,e.g. '<q' for ints or '<d' for floats
+
+    parameters:
+        fmt:struct format of one number
+    """
+
+    def __init__(self, fmt='<q'):
+        self.struct = struct.Struct(fmt)
+
+    def encode(self, value):
+        return self.struct.pack(value)
+
+    def decode(self, data):
+        return self.struct.unpack(_bytes(data))[0]
+
+
+class CompressedCodec(object):
+    """
+    Wrap a codec,encoded values of at least threshold bytes are zlib compressed.
+
+    A marker byte tells compressed values from the others,
+    so the threshold can be changed without rewriting stored values.
+
+    parameters:
+        codec:codec of the values,defaults to RawCodec
+        threshold:compress encoded values of at least that many bytes
+        level:zlib compression level
+    """
+
+    PLAIN = '\x00'
+    COMPRESSED = '\x01'
+
+    def __init__(self, codec=None, threshold=1024, level=6):
+        self.codec = codec if codec is not None else RawCodec()
+        self.threshold = threshold
+        self.level = level
+
+    def encode(self, value):
+        data = self.codec.encode(value)
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if len(data) >= self.threshold:
+            compressed = zlib.compress(data, self.level)
+            #incompressible values are kept plain
+            if len(compressed) < len(data):
+                return self.COMPRESSED + compressed
+        return self.PLAIN + data
+
+    def decode(self, data):
+        data = _bytes(data)
+        marker = data[:1]
+        if marker == self.COMPRESSED:
+            return self.codec.decode(zlib.decompress(buffer(data, 1)))
+        if marker == self.PLAIN:
+            return self.codec.decode(data[1:])
+        raise ValueError("Value without a codec marker")
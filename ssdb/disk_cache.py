@@ -0,0 +1,216 @@
+# encoding=utf-8
+"""
+Persistent second level cache of ssdb values
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from ssdb.client import cache_invalidations, encode_key, encode_value
+
+#sqlite limits the number of host parameters of a statement
+_MAX_PARAMS = 500
+
+
+def _write(db, sql, rows):
+    """
+    Run a statement for all rows in one transaction
+    """
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.executemany(sql, rows)
+    except:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+
+class DiskCache(object):
+    """
+    A cache of key values stored in a local sqlite file.
+
+    The file survives process restarts and can be shared by the worker
+    processes of a host, sqlite's locking keeps it consistent.
+    Entries expire after ttl seconds, once the cached values exceed max_bytes
+    the least recently read ones are evicted.
+
+    Cache errors (e.g. the file being locked for too long) are treated as misses,
+    reads then go to the server. Keys are stored as sent to the server,so 5 and '5' are one key.
+
+    Invalidations are remembered for invalidation_window seconds,a put given the time
+    its value was read at (since) is dropped if the key was invalidated after that,
+    so a value read before a write of another thread or process doesn't overwrite the invalidation.
+
+    parameters:
+        path:sqlite file path
+        max_bytes:bound on the size of cached keys and values
+        ttl:seconds an entry lives,None means until evicted or invalidated
+        busy_timeout:seconds to wait for another process holding the file lock
+    """
+
+    #check the size cap every that many writes of a process
+    evict_interval = 100
+    #read times are refreshed at most that often,to save writes on hot keys
+    touch_interval = 60
+    #invalidations are remembered that long,reads taking longer may cache stale values
+    invalidation_window = 3600
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 256, ttl=None, busy_timeout=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._writes = 0
+
+    def _db(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            #sqlite connections must not be shared by threads or forked processes
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.text_factory = str
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                       'key BLOB PRIMARY KEY, value BLOB, size INTEGER, expire_at REAL, accessed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            db.execute('CREATE TABLE IF NOT EXISTS invalidated (key BLOB PRIMARY KEY, at REAL)')
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def get(self, key):
+        """
+        return:
+            the cached value of key,None if not cached
+        """
+        key = encode_key(key)
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        return:
+            a key-value dict of the cached keys,keys as sent to the server
+        """
+        keys = map(encode_key, keys)
+        found = {}
+        now = time.time()
+        try:
+            db = self._db()
+            touch = []
+            for start in xrange(0, len(keys), _MAX_PARAMS):
+                part = keys[start:start + _MAX_PARAMS]
+                rows = db.execute('SELECT key, value, expire_at, accessed FROM cache WHERE key IN (%s)'
+                                  % ','.join('?' * len(part)), [sqlite3.Binary(key) for key in part])
+                for key, value, expire_at, accessed in rows:
+                    if expire_at is not None and expire_at <= now:
+                        continue
+                    found[str(key)] = str(value)
+                    if accessed < now - self.touch_interval:
+                        touch.append(key)
+            if touch:
+                _write(db, 'UPDATE cache SET accessed = ? WHERE key = ?',
+                       [(now, sqlite3.Binary(key)) for key in touch])
+        except sqlite3.Error:
+            pass
+        return found
+
+    def put(self, key, value, ttl=None, since=None):
+        """
+        Cache a value,ttl can only shorten the cache's ttl
+        """
+        self.put_many([(key, value)], ttl, since)
+
+    def put_many(self, items, ttl=None, since=None):
+        """
+        Cache (key, value) pairs
+
+        parameters:
+            ttl:seconds the values live,can only shorten the cache's ttl
+            since:time.time() before the values were read,keys invalidated since are not cached
+        """
+        if ttl is None or (self.ttl is not None and self.ttl < ttl):
+            ttl = self.ttl
+        now = time.time()
+        expire_at = now + ttl if ttl is not None else None
+        rows = []
+        for key, value in items:
+            key = encode_key(key)
+            value = encode_value(value)
+            if isinstance(value, memoryview):
+                value = value.tobytes()
+            rows.append((sqlite3.Binary(key), sqlite3.Binary(value), len(key) + len(value), expire_at, now))
+        if not rows:
+            return
+        try:
+            if since is None:
+                _write(self._db(), 'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)', rows)
+            else:
+                #checked in the write transaction,so no invalidation lands in between
+                _write(self._db(), 'INSERT OR REPLACE INTO cache SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS '
+                                   '(SELECT 1 FROM invalidated WHERE key = ? AND at >= ?)',
+                       [row + (row[0], since) for row in rows])
+        except sqlite3.Error:
+            return
+        self._writes += len(rows)
+        if self._writes >= self.evict_interval:
+            self._writes = 0
+            self.evict()
+
+    def delete(self, keys):
+        """
+        Drop the values of keys and remember they were invalidated
+        """
+        keys = map(encode_key, keys)
+        now = time.time()
+        try:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                for start in xrange(0, len(keys), _MAX_PARAMS):
+                    part = keys[start:start + _MAX_PARAMS]
+                    db.execute('DELETE FROM cache WHERE key IN (%s)' % ','.join('?' * len(part)),
+                               [sqlite3.Binary(key) for key in part])
+                db.executemany('INSERT OR REPLACE INTO invalidated VALUES (?, ?)',
+                               [(sqlite3.Binary(key), now) for key in keys])
+            except:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            pass
+
+    def invalidate_cmd(self, cmd, params):
+        """
+        Drop the values touched by a write cmd
+        """
+        keys = cache_invalidations.get(cmd)
+        if keys is not None:
+            keys = [cache_key[1] for cache_key in keys(params) if cache_key[0] == 'get']
+            if keys:
+                self.delete(keys)
+
+    def evict(self):
+        """
+        Drop expired entries,then least recently read ones until the cache fits in max_bytes
+        """
+        try:
+            db = self._db()
+            db.execute('DELETE FROM cache WHERE expire_at <= ?', (time.time(),))
+            db.execute('DELETE FROM invalidated WHERE at < ?', (time.time() - self.invalidation_window,))
+            size, count = db.execute('SELECT TOTAL(size), COUNT(*) FROM cache').fetchone()
+            while size > self.max_bytes and count:
+                #drop a tenth of the entries at a time
+                batch = max(1, count / 10)
+                db.execute('DELETE FROM cache WHERE key IN '
+                           '(SELECT key FROM cache ORDER BY accessed LIMIT ?)', (batch,))
+                size, count = db.execute('SELECT TOTAL(size), COUNT(*) FROM cache').fetchone()
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        try:
+            self._db().execute('DELETE FROM cache')
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,212 @@
+# encoding=utf-8
+"""
+Client metrics: per-cmd calls,error codes,latencies and bytes,pool checkout waits and occupancy
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+#upper bounds in seconds of the latency histogram buckets,100us to about 6.5s,then the rest
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** i for i in xrange(17)) + (float('inf'),)
+
+
+class Histogram(object):
+    """
+    Counts of values in fixed buckets,with their count,sum and max
+
+    parameters:
+        buckets:sorted upper bounds of the buckets,the last one should be inf
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        return:
+            the upper bound of the bucket holding the percentile,the max for the last bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': [(bound, count) for bound, count in zip(self.buckets, self.counts) if count],
+        }
+
+
+class _CommandStats(object):
+    __slots__ = ('calls', 'errors', 'latency', 'request_bytes', 'response_bytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = {}
+        self.latency = Histogram()
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': dict(self.errors),
+            'latency': self.latency.snapshot(),
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+        }
+
+
+class ClientMetrics(object):
+    """
+    Metrics of the requests of one or more SSDB clients.
+
+    Every request records its cmd,latency and response code,'ok' and 'not_found' are
+    not errors,exceptions are recorded by their class name. Requests sent on a pool
+    connection also record their request and response sizes,requests of a
+    MultiplexedConnection don't. Pools record how long get_connection() waited.
+    A multi_* cmd split in chunks counts one request per chunk,or one request if its chunks
+    were pipelined,cmds sent in a Pipeline are not recorded,only the checkout of its connection is.
+
+    Hooks registered with add_hook are called around each request:
+        before(cmd, params)
+        after(cmd, params, resp, seconds, error),resp is None and error the exception if it raised
+
+    usage:
+        metrics = ClientMetrics()
+        ssdb = SSDB('127.0.0.1', 8888, metrics=metrics)
+        metrics.snapshot()['commands']['get']['latency']['p99']
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._before = ()
+        self._after = ()
+        self._pools = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the recorded values,hooks and watched pools are kept
+        """
+        with self._lock:
+            self._commands = {}
+            self._checkout = Histogram()
+            self._peak_in_use = dict.fromkeys(self._pools, 0)
+
+    def add_hook(self, before=None, after=None):
+        with self._lock:
+            if before is not None:
+                self._before += (before,)
+            if after is not None:
+                self._after += (after,)
+
+    def remove_hook(self, before=None, after=None):
+        with self._lock:
+            self._before = tuple(hook for hook in self._before if hook is not before)
+            self._after = tuple(hook for hook in self._after if hook is not after)
+
+    def watch_pool(self, pool, name=None):
+        """
+        Report the occupancy of a ConnectionPool and record its checkout waits
+        """
+        if name is None:
+            name = '%s:%s' % (pool.host, pool.port)
+        with self._lock:
+            self._pools[name] = pool
+            self._peak_in_use.setdefault(name, 0)
+        pool.metrics = self
+        pool.metrics_name = name
+
+    def _stats(self, cmd):
+        stats = self._commands.get(cmd)
+        if stats is None:
+            stats = self._commands[cmd] = _CommandStats()
+        return stats
+
+    def call(self, cmd, params, send):
+        """
+        Run send(cmd, params) with the hooks and record it
+        """
+        for hook in self._before:
+            hook(cmd, params)
+        resp = error = None
+        start = time.time()
+        try:
+            resp = send(cmd, params)
+            return resp
+        except Exception, error:
+            raise
+        finally:
+            seconds = time.time() - start
+            code = type(error).__name__ if error is not None else getattr(resp, 'code', 'ok')
+            with self._lock:
+                stats = self._stats(cmd)
+                stats.calls += 1
+                stats.latency.record(seconds)
+                if code != 'ok' and code != 'not_found':
+                    stats.errors[code] = stats.errors.get(code, 0) + 1
+            for hook in self._after:
+                hook(cmd, params, resp, seconds, error)
+
+    def record_bytes(self, cmd, request_bytes, response_bytes):
+        with self._lock:
+            stats = self._stats(cmd)
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+
+    def record_checkout(self, pool, seconds, in_use):
+        with self._lock:
+            self._checkout.record(seconds)
+            name = pool.metrics_name
+            if in_use > self._peak_in_use.get(name, 0):
+                self._peak_in_use[name] = in_use
+
+    def snapshot(self):
+        """
+        return:
+            a dict of the metrics:
+            'commands':cmd -> {'calls','errors' (code -> count),'latency' (see Histogram.snapshot),
+                'request_bytes','response_bytes'}
+            'pool_wait':Histogram.snapshot() of the seconds get_connection() took
+            'pools':name -> {'max_connections','connections','in_use','available','peak_in_use'}
+        """
+        with self._lock:
+            commands = dict((cmd, stats.snapshot()) for cmd, stats in self._commands.iteritems())
+            pool_wait = self._checkout.snapshot()
+            pools = {}
+            for name, pool in self._pools.iteritems():
+                pools[name] = {
+                    'max_connections': pool.max_connections,
+                    'connections': pool._created_connections,
+                    'in_use': len(pool._in_use_connections),
+                    'available': len(pool._available_connections),
+                    'peak_in_use': self._peak_in_use.get(name, 0),
+                }
+        return {'commands': commands, 'pool_wait': pool_wait, 'pools': pools}
@@ -0,0 +1,234 @@
+# encoding=utf-8
+"""
+Client spreading keys over many ssdb servers
+"""
+
+import hashlib
+import struct
+from bisect import bisect
+from itertools import imap
+from multiprocessing.pool import ThreadPool
+
+from ssdb.client import SSDB, SSDBResponse, ScanResult, encode_key, registered_cmds
+
+
+def _hash(value):
+    return struct.unpack('<I', hashlib.md5(value).digest()[:4])[0]
+
+
+class HashRing(object):
+    """
+    Consistent hash ring,each node is placed on the ring replicas times
+    so keys move only between the changed node and the others when nodes change.
+
+    parameters:
+        nodes:node names
+        replicas:virtual nodes per node
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.replicas = replicas
+        points = []
+        for node in nodes:
+            for i in xrange(replicas):
+                points.append((_hash('%s-%d' % (node, i)), node))
+        points.sort()
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def get_node(self, key):
+        #hash the key as sent,so 5 and '5' are on the same node
+        index = bisect(self._hashes, _hash(encode_key(key)))
+        if index == len(self._hashes):
+            index = 0
+        return self._nodes[index]
+
+
+class ShardedSSDB(object):
+    """
+    A client for many ssdb servers.
+
+    Keys,and hashmap/zset names,are placed on the servers with a consistent hash ring.
+    Methods taking a key or name first are sent to the server owning it,
+    multi_get/multi_set/multi_del/multi_exists are split by server and run in parallel,
+    range methods (keys,scan,rscan,hlist,zlist and their iterators) query every server
+    and merge the results.
+
+    parameters:
+        nodes:list of (host, port)
+        replicas:virtual nodes per server on the hash ring
+        workers:threads running the requests of split multi_* calls,defaults to the server count
+        **kwargs:passed to the SSDB of every server,e.g. socket_timeout,max_connections
+    """
+
+    #SSDB methods whose first argument is not a key or name
+    _unroutable = set(['request', 'pipeline', 'generate_cmd', 'parse_response', 'map_func', 'parallel_scan'])
+
+    def __init__(self, nodes, replicas=160, workers=None, **kwargs):
+        self.clients = {}
+        for host, port in nodes:
+            self.clients['%s:%s' % (host, port)] = SSDB(host, port, **kwargs)
+        self.ring = HashRing(sorted(self.clients), replicas)
+        self.codec = kwargs.get('codec')
+        self._workers = ThreadPool(workers or len(self.clients))
+
+    def get_client(self, key):
+        """
+        return:
+            the SSDB of the server owning key
+        """
+        return self.clients[self.ring.get_node(key)]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in self._unroutable or not (hasattr(SSDB, name) or name in registered_cmds):
+            raise AttributeError(name)
+
+        def route(key, *args, **kwargs):
+            if isinstance(key, (list, tuple, dict)):
+                #keys of many servers,only the multi_* methods defined here split them
+                raise TypeError("ShardedSSDB can't route %s of many keys" % name)
+            return getattr(self.get_client(key), name)(key, *args, **kwargs)
+        route.__name__ = name
+        return route
+
+    def _group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring.get_node(key), []).append(key)
+        return groups
+
+    def _run(self, calls):
+        """
+        Run (function, args) calls in parallel,return their results in order
+        """
+        if len(calls) == 1:
+            function, args = calls[0]
+            return [function(*args)]
+        return self._workers.map(lambda call: call[0](*call[1]), calls)
+
+    def _scatter(self, method, *args):
+        return self._run([(getattr(client, method), args) for client in self.clients.itervalues()])
+
+    def multi_get(self, keys):
+        """
+        Get those keys' values from their servers
+
+        return:
+            'ok' code if success,'data["index"]' is a keys list in the given order,
+            'data["items"]' is key-value dict;other code failed
+        """
+        groups = self._group(keys)
+        responses = self._run([(self.clients[node].multi_get, (part,)) for node, part in groups.iteritems()])
+        items = {}
+        for resp in responses:
+            if not resp.ok():
+                return resp
+            items.update(resp.data['items'])
+        keys = [key for key in imap(encode_key, keys) if key in items]
+        return SSDBResponse('ok', ScanResult.from_items(keys, items))
+
+    def multi_exists(self, keys):
+        """
+        Check whether those keys exist on their servers
+
+        return:
+            'ok' code if success,'data' is a key-bool dict;other code failed
+        """
+        groups = self._group(keys)
+        responses = self._run([(self.clients[node].multi_exists, (part,)) for node, part in groups.iteritems()])
+        exists = {}
+        for resp in responses:
+            if not resp.ok():
+                return resp
+            exists.update(resp.data)
+        return SSDBResponse('ok', exists)
+
+    def _count(self, responses):
+        count = 0
+        for resp in responses:
+            if not resp.ok():
+                return resp
+            count += resp.data
+        return SSDBResponse('ok', count)
+
+    def multi_set(self, key_value_map):
+        """
+        Set multiple key-value pairs on their servers
+
+        return 'ok' code if success,other code failed
+        """
+        groups = {}
+        for key, value in key_value_map.iteritems():
+            groups.setdefault(self.ring.get_node(key), {})[key] = value
+        return self._count(self._run([(self.clients[node].multi_set, (part,))
+                                      for node, part in groups.iteritems()]))
+
+    def multi_del(self, keys):
+        """
+        Delete those keys' values on their servers
+
+        return 'ok' code if success,other code failed
+        """
+        groups = self._group(keys)
+        return self._count(self._run([(self.clients[node].multi_del, (part,))
+                                      for node, part in groups.iteritems()]))
+
+    def _merge_lists(self, responses, limit, reverse=False):
+        merged = []
+        for resp in responses:
+            if not resp.ok():
+                return resp
+            merged.extend(resp.data)
+        merged.sort(reverse=reverse)
+        return SSDBResponse('ok', merged[:int(limit)])
+
+    def _merge_scans(self, responses, limit, reverse=False):
+        items = {}
+        for resp in responses:
+            if not resp.ok():
+                return resp
+            items.update(resp.data['items'])
+        return SSDBResponse('ok', ScanResult.from_items(sorted(items, reverse=reverse)[:int(limit)], items))
+
+    def keys(self, key_lower, key_upper, limit):
+        """
+        list keys in range (key_lower,key_upper] of all servers,see SSDB.keys
+        """
+        return self._merge_lists(self._scatter('keys', key_lower, key_upper, limit), limit)
+
+    def scan(self, key_lower, key_upper, limit):
+        """
+        list key-value pairs in key range (key_lower,key_upper] of all servers,see SSDB.scan
+        """
+        return self._merge_scans(self._scatter('scan', key_lower, key_upper, limit), limit)
+
+    def rscan(self, key_upper, key_lower, limit):
+        """
+        list key-value pairs in key range (key_upper,key_lower] of all servers in reverse order,see SSDB.rscan
+        """
+        return self._merge_scans(self._scatter('rscan', key_upper, key_lower, limit), limit, True)
+
+    def hlist(self, name_lower, name_upper, limit):
+        """
+        Get hashmap names in range (name_lower,name_upper] of all servers,see SSDB.hlist
+        """
+        return self._merge_lists(self._scatter('hlist', name_lower, name_upper, limit), limit)
+
+    def zlist(self, name_lower, name_upper, limit):
+        """
+        Get zset names in range (name_lower,name_upper] of all servers,see SSDB.zlist
+        """
+        return self._merge_lists(self._scatter('zlist', name_lower, name_upper, limit), limit)
+
+    _range_iterator = SSDB._range_iterator.im_func
+    keys_iterator = SSDB.keys_iterator.im_func
+    scan_iterator = SSDB.scan_iterator.im_func
+    rscan_iterator = SSDB.rscan_iterator.im_func
+    hlist_iterator = SSDB.hlist_iterator.im_func
+    zlist_iterator = SSDB.zlist_iterator.im_func
+
+    def close(self):
+        """
+        Stop the worker threads
+        """
+        self._workers.close()
@@ -0,0 +1,318 @@
+# encoding=utf-8
+"""
+Binary dump and restore of key-values,hashmaps and zsets.
+
+A dump file is a header,blocks of records,then an index of the blocks:
+
+    header: '<8sII' magic,version,flags
+    block:  '<cIIII' 'B',stored size,raw size,record count,crc32 of the stored bytes,
+            then the records,zlib compressed if the header flags say so
+    index:  '<cIIII' 'X',size,block count,0,0,then a '<Q' offset per block,
+            then '<Q8s' offset of the index and the index magic
+
+A record is a kind byte,'k' key value,'h' name key value or 'z' name key score,
+strings are prefixed by their '<I' length,scores are '<q'.
+Values are stored as sent to the server,encoded with the client's codec if it has one.
+"""
+
+import os
+import struct
+import zlib
+
+from ssdb.client import ResponseError
+
+_HEADER = struct.Struct('<8sII')
+_BLOCK = struct.Struct('<cIIII')
+_FOOTER = struct.Struct('<Q8s')
+_LENGTH = struct.Struct('<I')
+_SCORE = struct.Struct('<q')
+_OFFSET = struct.Struct('<Q')
+_MAGIC = 'SSDBDUMP'
+_INDEX_MAGIC = 'SSDBDIDX'
+_VERSION = 1
+_COMPRESSED = 1
+
+#dump order of the record kinds
+_KINDS = 'khz'
+
+
+def _string(value):
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return str(value)
+
+
+def _encode(record, parts):
+    kind, name, key, value = record
+    parts.append(kind)
+    if kind != 'k':
+        parts.append(_LENGTH.pack(len(name)))
+        parts.append(name)
+    parts.append(_LENGTH.pack(len(key)))
+    parts.append(key)
+    if kind == 'z':
+        parts.append(_SCORE.pack(value))
+    else:
+        value = _string(value)
+        parts.append(_LENGTH.pack(len(value)))
+        parts.append(value)
+
+
+def _decode(payload):
+    """
+    return:
+        the (kind, name, key, value) records of a block
+    """
+    records = []
+    pos = 0
+    end = len(payload)
+    while pos < end:
+        kind = payload[pos]
+        pos += 1
+        name = None
+        if kind != 'k':
+            length = _LENGTH.unpack_from(payload, pos)[0]
+            name = payload[pos + 4:pos + 4 + length]
+            pos += 4 + length
+        length = _LENGTH.unpack_from(payload, pos)[0]
+        key = payload[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        if kind == 'z':
+            value = _SCORE.unpack_from(payload, pos)[0]
+            pos += 8
+        else:
+            length = _LENGTH.unpack_from(payload, pos)[0]
+            value = payload[pos + 4:pos + 4 + length]
+            pos += 4 + length
+        records.append((kind, name, key, value))
+    return records
+
+
+def _read_header(f, path):
+    data = f.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        raise ValueError("Not a dump file: %s" % path)
+    magic, version, flags = _HEADER.unpack(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("Not a dump file: %s" % path)
+    return flags
+
+
+def _blocks(f, flags):
+    """
+    Read the blocks from the current position up to the index or the first incomplete block
+
+    return:
+        iterator of (offset, records)
+    """
+    while True:
+        offset = f.tell()
+        data = f.read(_BLOCK.size)
+        if len(data) < _BLOCK.size:
+            return
+        kind, stored_size, raw_size, count, crc = _BLOCK.unpack(data)
+        if kind != 'B':
+            return
+        stored = f.read(stored_size)
+        if len(stored) < stored_size or zlib.crc32(stored) & 0xffffffff != crc:
+            return
+        payload = zlib.decompress(stored) if flags & _COMPRESSED else stored
+        yield offset, _decode(payload)
+
+
+def _read_index(f):
+    """
+    return:
+        the block offsets of a complete dump,None if the dump has no index
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size < _HEADER.size + _FOOTER.size:
+        return None
+    f.seek(size - _FOOTER.size)
+    index_offset, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+    if magic != _INDEX_MAGIC:
+        return None
+    f.seek(index_offset)
+    kind, index_size, count, _, _ = _BLOCK.unpack(f.read(_BLOCK.size))
+    data = f.read(index_size)
+    return [_OFFSET.unpack_from(data, i * _OFFSET.size)[0] for i in xrange(count)]
+
+
+def _records(client, key_lower, key_upper, kinds, last):
+    """
+    Records of the kinds to dump,in dump order,after the last dumped record
+    """
+    done = _KINDS.index(last[0]) if last is not None else -1
+    if 'k' in kinds and done <= 0:
+        for key, value in client.scan_iterator(last[2] if done == 0 else key_lower, key_upper):
+            yield 'k', None, key, value
+    for kind, list_iterator, scan_iterator in (('h', client.hlist_iterator, client.hscan_iterator),
+                                               ('z', client.zlist_iterator, client.zscan_iterator)):
+        if kind not in kinds or done > _KINDS.index(kind):
+            continue
+        name_lower = key_lower
+        if last is not None and last[0] == kind:
+            #finish the hashmap or zset the dump stopped in
+            name_lower = last[1]
+            start = (last[2],) if kind == 'h' else (last[2], last[3])
+            for key, value in scan_iterator(name_lower, *start):
+                yield kind, name_lower, key, value
+        for name in list_iterator(name_lower, key_upper):
+            for key, value in scan_iterator(name):
+                yield kind, name, key, value
+
+
+def dump(client, path, key_lower='', key_upper='', kinds='khz', compress=True,
+         block_bytes=1024 * 1024, resume=False, progress=None):
+    """
+    Dump key-values,hashmaps and zsets to a file.
+
+    Records are streamed from the scan iterators,memory holds about one block.
+    With resume an existing,unfinished dump continues after its last complete block.
+
+    parameters:
+        client:SSDB to dump
+        path:dump file path
+        key_lower,key_upper:range (key_lower,key_upper] of the keys,hashmap and zset names to dump
+        kinds:what to dump,'k' key-values,'h' hashmaps,'z' zsets
+        compress:zlib compress the blocks,ignored when resuming
+        block_bytes:size of the records of a block before compression
+        resume:continue the dump of an existing file
+        progress:function called with the stats dict after each block
+    return:
+        the stats dict,'blocks' and 'records' count the whole file
+    """
+    offsets = []
+    stats = {'blocks': 0, 'records': 0, 'bytes': 0}
+    last = None
+    if resume and os.path.exists(path):
+        f = open(path, 'r+b')
+        flags = _read_header(f, path)
+        for offset, records in _blocks(f, flags):
+            offsets.append(offset)
+            stats['records'] += len(records)
+            last = records[-1]
+        #drop an incomplete block or the index
+        end = _HEADER.size
+        if offsets:
+            f.seek(offsets[-1])
+            stored_size = _BLOCK.unpack(f.read(_BLOCK.size))[1]
+            end = offsets[-1] + _BLOCK.size + stored_size
+        f.seek(end)
+        f.truncate()
+        stats['blocks'] = len(offsets)
+    else:
+        f = open(path, 'wb')
+        flags = _COMPRESSED if compress else 0
+        f.write(_HEADER.pack(_MAGIC, _VERSION, flags))
+
+    def write_block(parts, count):
+        payload = ''.join(parts)
+        stored = zlib.compress(payload) if flags & _COMPRESSED else payload
+        offsets.append(f.tell())
+        f.write(_BLOCK.pack('B', len(stored), len(payload), count, zlib.crc32(stored) & 0xffffffff))
+        f.write(stored)
+        f.flush()
+        stats['blocks'] += 1
+        stats['records'] += count
+        stats['bytes'] += len(payload)
+        if progress is not None:
+            progress(dict(stats))
+
+    try:
+        codec = getattr(client, 'codec', None)
+        parts, size, count = [], 0, 0
+        for record in _records(client, key_lower, key_upper, kinds, last):
+            if codec is not None and record[0] != 'z':
+                #the iterators return decoded values
+                record = record[:3] + (codec.encode(record[3]),)
+            start = len(parts)
+            _encode(record, parts)
+            size += sum(len(part) for part in parts[start:])
+            count += 1
+            if size >= block_bytes:
+                write_block(parts, count)
+                parts, size, count = [], 0, 0
+        if count:
+            write_block(parts, count)
+
+        index_offset = f.tell()
+        index = ''.join(_OFFSET.pack(offset) for offset in offsets)
+        f.write(_BLOCK.pack('X', len(index), len(offsets), 0, 0))
+        f.write(index)
+        f.write(_FOOTER.pack(index_offset, _INDEX_MAGIC))
+    finally:
+        f.close()
+    return stats
+
+
+def read_records(path, start_block=0):
+    """
+    return:
+        an iterator of the (kind, name, key, value) records of a dump,from block start_block on
+    """
+    for index, records in _read_blocks(path, start_block):
+        for record in records:
+            yield record
+
+
+def _read_blocks(path, start_block):
+    with open(path, 'rb') as f:
+        flags = _read_header(f, path)
+        offsets = _read_index(f) if start_block else None
+        if offsets is not None:
+            if start_block >= len(offsets):
+                return
+            f.seek(offsets[start_block])
+            skip = 0
+        else:
+            #unfinished dumps have no index
+            f.seek(_HEADER.size)
+            skip = start_block
+        index = start_block - skip
+        for offset, records in _blocks(f, flags):
+            if index >= start_block:
+                yield index, records
+            index += 1
+
+
+def restore(client, path, start_block=0, progress=None):
+    """
+    Write the records of a dump back with batched multi_set/multi_hset/multi_zset.
+
+    Each block is sent as one pipeline,memory holds about one block.
+    To resume,pass the 'blocks' count of the last progress call as start_block.
+
+    parameters:
+        client:SSDB to write to
+        path:dump file path
+        start_block:index of the first block to restore
+        progress:function called with the stats dict after each block
+    return:
+        the stats dict,'blocks' is the index of the block after the last restored one
+    """
+    stats = {'blocks': start_block, 'records': 0}
+    for index, records in _read_blocks(path, start_block):
+        pipe = client.pipeline(max_commands=len(records) + 1, max_bytes=float('inf'))
+        params = None
+        current = None
+        for kind, name, key, value in records:
+            if params is None or (kind, name) != current:
+                if params is not None:
+                    pipe.request(cmd, params)
+                current = kind, name
+                cmd = {'k': 'multi_set', 'h': 'multi_hset', 'z': 'multi_zset'}[kind]
+                params = [] if kind == 'k' else [name]
+            params.append(key)
+            params.append(value)
+        if params is not None:
+            pipe.request(cmd, params)
+        for resp in pipe.execute():
+            if not resp.ok():
+                raise ResponseError(resp.code, resp.message)
+        stats['blocks'] = index + 1
+        stats['records'] += len(records)
+        if progress is not None:
+            progress(dict(stats))
+    return stats
@@ -1,5 +1,10 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
 import ssdb
+import threading
 import time
 
 
@@ -43,6 +48,14 @@ class SSDBTest(unittest.TestCase):
         self.assertEqual("value1", r.data)
         self.ssdb.delete("key1")
 
+    def test_set_large_value(self):
+        value = 'v' * (1024 * 1024)
+        r = self.ssdb.set("key_large", value)
+        self.assertEqual("ok", r.code)
+        r = self.ssdb.get("key_large")
+        self.assertEqual(value, r.data)
+        self.ssdb.delete("key_large")
+
     def test_get(self):
         self.ssdb.delete("key1")
         r = self.ssdb.get("key1")
@@ -386,6 +399,830 @@ class SSDBTest(unittest.TestCase):
         r = self.ssdb.zget("multi_zdel", 'key2')
         self.assertEqual('not_found', r.code)
 
+    def test_pipeline(self):
+        with self.ssdb.pipeline() as pipe:
+            pipe.set("pipe_key", "pipe_value").get("pipe_key")
+            pipe.zset("pipe_zset", "key", 10).zincr("pipe_zset", "key", 2)
+            responses = pipe.execute()
+
+        self.assertEqual(4, len(responses))
+        self.assertEqual("pipe_value", responses[1].data)
+        self.assertEqual(12, responses[3].data)
+        self.ssdb.delete("pipe_key")
+
+    def test_pipeline_auto_flush(self):
+        pipe = self.ssdb.pipeline(max_commands=10)
+        for i in range(25):
+            pipe.hset("pipe_hset", "key_%d" % i, i)
+        self.assertEqual(5, len(pipe))
+
+        responses = pipe.hsize("pipe_hset").execute()
+        self.assertEqual(26, len(responses))
+        self.assertEqual(25, responses[-1].data)
+
+        with self.ssdb.pipeline() as pipe:
+            pipe.multi_hdel("pipe_hset", ["key_%d" % i for i in range(25)])
+        self.assertEqual(0, self.ssdb.hsize("pipe_hset").data)
+
+    def test_coalesce(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, coalesce_window=0.05, coalesce_max_batch=8)
+        client.multi_set({"coalesce_%d" % i: "value_%d" % i for i in range(6)})
+        client.multi_zset("coalesce_zset", {"a": 1, "b": 2})
+        requests = []
+        request = client.request
+
+        def counting_request(cmd, params=[]):
+            requests.append(cmd)
+            return request(cmd, params)
+        client.coalescer._request = counting_request
+
+        results = {}
+
+        def read(key):
+            results[key] = client.get(key)
+        threads = [threading.Thread(target=read, args=("coalesce_%d" % i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(["multi_get"], requests)
+        self.assertEqual("value_3", results["coalesce_3"].data)
+        self.assertEqual("not_found", results["coalesce_7"].code)
+        self.assertEqual(2, client.zget("coalesce_zset", "b").data)
+
+        #keys are looked up in the response as sent
+        client.multi_set({"4242": "int", u"coalesce_\xe9": "unicode"})
+        self.assertEqual("int", client.get(4242).data)
+        self.assertEqual("unicode", client.get(u"coalesce_\xe9").data)
+        client.multi_del(["coalesce_%d" % i for i in range(6)] + [4242, u"coalesce_\xe9"])
+        client.multi_zdel("coalesce_zset", ["a", "b"])
+
+    def test_multiplex(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, multiplex=True)
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(20):
+                    key = "multiplex_%d_%d" % (n, i)
+                    client.set(key, i)
+                    self.assertEqual(str(i), client.get(key).data)
+                    client.delete(key)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], errors)
+
+        futures = [client.set_async("multiplex_async", "value"), client.get_async("multiplex_async")]
+        self.assertEqual("ok", futures[0].result(1).code)
+        self.assertEqual("value", futures[1].result(1).data)
+        client.delete("multiplex_async")
+
+        #a response is delivered while another thread is still sending
+        future = client.get_async("multiplex_async")
+        with client.multiplexer._send_lock:
+            self.assertEqual("not_found", future.result(1).code)
+
+        client.multiplexer.close()
+        self.assertEqual("not_found", client.get("multiplex_async").code)
+
+    def test_cache(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, cache_max_bytes=1024 * 1024)
+        client.set("cache_key", "value")
+        self.ssdb.set("cache_key", "changed by other client")
+        r = client.get("cache_key")
+        self.assertEqual("value", r.data)
+
+        client.delete("cache_key")
+        self.assertEqual(None, client.cache.get(("get", "cache_key")))
+        self.assertEqual("not_found", client.get("cache_key").code)
+        self.assertEqual("not_found", client.cache.get(("get", "cache_key")).code)
+
+        client.multi_hset("cache_hset", {"a": "1", "b": "2"})
+        self.assertEqual("1", client.hget("cache_hset", "a").data)
+        client.hincr("cache_hset", "a", 1)
+        self.assertEqual("2", client.hget("cache_hset", "a").data)
+
+        #5 and '5' are the same key on the server
+        client.set(5, "a")
+        client.set("5", "b")
+        self.assertEqual("b", client.get(5).data)
+        client.delete("5")
+        self.assertEqual("not_found", client.get(5).code)
+        client.hset("cache_hset", 7, "x")
+        self.assertEqual("x", client.hget(u"cache_hset", 7).data)
+        client.hdel("cache_hset", "7")
+        self.assertEqual("not_found", client.hget("cache_hset", 7).code)
+        client.hclear("cache_hset")
+
+    def test_cache_ttl(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, cache_max_bytes=1024 * 1024, cache_ttl=60)
+        client.set("cache_ttl_key", "value", 1)
+        self.assertEqual("value", client.get("cache_ttl_key").data)
+        time.sleep(1)
+        self.assertEqual("not_found", client.get("cache_ttl_key").code)
+
+    def test_cache_eviction(self):
+        cache = ssdb.ReadCache(max_bytes=ssdb.ReadCache.entry_overhead * 3)
+        for key in ["a", "b", "c"]:
+            cache.put(("get", key), ssdb.SSDBResponse('ok', key))
+        self.assertEqual(None, cache.get(("get", "a")))
+        self.assertEqual("b", cache.get(("get", "b")).data)
+        cache.put(("get", "d"), ssdb.SSDBResponse('ok', "d"))
+        self.assertEqual(None, cache.get(("get", "c")))
+        self.assertEqual("b", cache.get(("get", "b")).data)
+
+    def test_cache_single_flight(self):
+        cache = ssdb.ReadCache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return ssdb.SSDBResponse('ok', "value")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.load(("get", "key"), loader)))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(calls))
+        self.assertEqual(["value"] * 8, [r.data for r in results])
+
+    def test_disk_cache(self):
+        path = tempfile.mkdtemp()
+        try:
+            disk_cache = ssdb.DiskCache(os.path.join(path, 'cache.db'))
+            client = ssdb.SSDB('127.0.0.1', 8888, disk_cache=disk_cache)
+            client.multi_set({"disk_a": "a", "disk_b": "b"})
+            client.get("disk_a")
+            self.assertEqual("a", disk_cache.get("disk_a"))
+
+            r = client.multi_get(["disk_a", "disk_b", "disk_c"])
+            self.assertEqual(["disk_a", "disk_b"], r.data['index'])
+            self.assertEqual("b", disk_cache.get("disk_b"))
+
+            #a new process finds the values cached by the previous one
+            self.ssdb.set("disk_a", "changed by other client")
+            restarted = ssdb.SSDB('127.0.0.1', 8888, disk_cache=ssdb.DiskCache(os.path.join(path, 'cache.db')))
+            self.assertEqual("a", restarted.get("disk_a").data)
+
+            restarted.delete("disk_a")
+            self.assertEqual(None, disk_cache.get("disk_a"))
+            #a value read before an invalidation of another client is not cached
+            since = time.time()
+            restarted.delete("disk_b")
+            disk_cache.put("disk_b", "stale", since=since)
+            self.assertEqual(None, disk_cache.get("disk_b"))
+            time.sleep(0.01)
+            disk_cache.put("disk_b", "fresh", since=time.time())
+            self.assertEqual("fresh", disk_cache.get("disk_b"))
+            client.multi_del(["disk_b"])
+
+            #keys are cached as sent to the server
+            self.assertTrue(client.set(5, "int").ok())
+            self.assertEqual("int", client.get(5).data)
+            self.assertEqual("int", disk_cache.get("5"))
+            r = client.multi_get([5, "disk_x"])
+            self.assertEqual(["5"], r.data['index'])
+            self.assertEqual("int", r.data['items']["5"])
+            self.assertTrue(client.set(u"disk_\xe9", "unicode").ok())
+            self.assertEqual("unicode", client.get(u"disk_\xe9").data)
+            self.assertEqual("unicode", disk_cache.get(u"disk_\xe9"))
+            self.assertTrue(client.delete(5).ok())
+            self.assertEqual(None, disk_cache.get(5))
+            client.multi_del([u"disk_\xe9"])
+        finally:
+            shutil.rmtree(path)
+
+    def test_disk_cache_eviction(self):
+        path = tempfile.mkdtemp()
+        try:
+            disk_cache = ssdb.DiskCache(os.path.join(path, 'cache.db'), max_bytes=1000, ttl=60)
+            disk_cache.put_many(("key_%d" % i, "v" * 100) for i in range(20))
+            disk_cache.evict()
+            self.assertEqual(None, disk_cache.get("key_0"))
+            self.assertEqual("v" * 100, disk_cache.get("key_19"))
+
+            disk_cache.put("key_ttl", "value", -1)
+            self.assertEqual(None, disk_cache.get("key_ttl"))
+        finally:
+            shutil.rmtree(path)
+
+    def test_bloom_filter(self):
+        self.ssdb.set("bloom_a", "a")
+        self.ssdb.hset("bloom_h", "k", "v")
+        bloom = ssdb.BloomFilter.from_ssdb(self.ssdb, 1000, 0.001, hashes=True)
+        client = ssdb.SSDB('127.0.0.1', 8888, bloom_filter=bloom)
+        requests = []
+        request = client.request
+
+        def counting_request(cmd, params=[]):
+            requests.append(cmd)
+            return request(cmd, params)
+        client.request = counting_request
+
+        self.assertEqual("a", client.get("bloom_a").data)
+        self.assertEqual("v", client.hget("bloom_h", "k").data)
+        self.assertEqual("not_found", client.get("bloom_missing").code)
+        self.assertEqual("not_found", client.hget("bloom_h", "missing").code)
+        self.assertEqual(["get", "hget"], requests)
+
+        client.set("bloom_b", "b")
+        self.assertEqual("b", client.get("bloom_b").data)
+        #keys are hashed as sent to the server
+        self.assertTrue(client.set(12345, "int").ok())
+        self.assertEqual("int", client.get(12345).data)
+        self.assertEqual("int", client.get("12345").data)
+        self.assertTrue(client.set(u"bloom_\xe9", "unicode").ok())
+        self.assertEqual("unicode", client.get(u"bloom_\xe9").data)
+        self.assertEqual("not_found", client.hget(u"bloom_\xe9", 1).code)
+        client.multi_del([12345, u"bloom_\xe9"])
+
+        path = tempfile.mkdtemp()
+        try:
+            bloom.save(os.path.join(path, 'bloom'))
+            loaded = ssdb.BloomFilter.load(os.path.join(path, 'bloom'))
+            self.assertTrue(loaded.might_exist(("get", "bloom_b")))
+            self.assertTrue(loaded.might_exist(("hget", "bloom_h", "k")))
+        finally:
+            shutil.rmtree(path)
+        client.delete("bloom_a")
+        client.delete("bloom_b")
+        client.hdel("bloom_h", "k")
+
+    def test_hash_ring(self):
+        ring = ssdb.HashRing(["a", "b", "c"])
+        keys = ["key_%d" % i for i in range(1000)]
+        placed = [ring.get_node(key) for key in keys]
+        self.assertEqual(set(["a", "b", "c"]), set(placed))
+
+        ring = ssdb.HashRing(["a", "b", "c", "d"])
+        moved = [key for key, node in zip(keys, placed) if ring.get_node(key) != node]
+        self.assertTrue(all(ring.get_node(key) == "d" for key in moved))
+        self.assertTrue(len(moved) < 400)
+
+    def test_sharded(self):
+        #two names of the same server make two shards
+        client = ssdb.ShardedSSDB([('127.0.0.1', 8888), ('localhost', 8888)], max_connections=4)
+        data = dict(("shard_%d" % i, "value_%d" % i) for i in range(20))
+        self.assertEqual(20, client.multi_set(data).data)
+        nodes = set(client.ring.get_node(key) for key in data)
+        self.assertEqual(2, len(nodes))
+
+        keys = sorted(data, reverse=True) + ["shard_missing"]
+        r = client.multi_get(keys)
+        self.assertEqual(sorted(data, reverse=True), r.data['index'])
+        self.assertEqual("value_3", r.data['items']["shard_3"])
+
+        self.assertEqual("value_4", client.get("shard_4").data)
+        self.assertEqual({"shard_3": True, "shard_4": True, "shard_missing": False},
+                         client.multi_exists(["shard_3", "shard_4", "shard_missing"]).data)
+        self.assertRaises(TypeError, client.multi_hget, ["shard_hash"], ["k"])
+        client.hset("shard_hash", "k", "v")
+        self.assertEqual("v", client.hget("shard_hash", "k").data)
+        client.hdel("shard_hash", "k")
+
+        r = client.scan("shard_", "shard_z", 5)
+        self.assertEqual(sorted(data)[:5], r.data['index'])
+
+        #keys are routed and indexed as sent to the server
+        self.assertTrue(client.set(5, "int").ok())
+        self.assertEqual("int", client.get("5").data)
+        self.assertTrue(client.set(u"shard_\xe9", "unicode").ok())
+        r = client.multi_get([5, u"shard_\xe9", "shard_missing"])
+        self.assertEqual(["5", "shard_\xc3\xa9"], r.data['index'])
+        self.assertEqual("unicode", r.data['items']["shard_\xc3\xa9"])
+        self.assertEqual(2, client.multi_del([5, u"shard_\xe9"]).data)
+
+        self.assertEqual(20, client.multi_del(data.keys()).data)
+        self.assertEqual(0, len(client.multi_get(keys).data['index']))
+        client.close()
+
+    def test_replicas(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, replicas=[('localhost', 8888), ('127.0.0.1', 1)])
+        router = client.replica_router
+        router.explore_rate = 0
+        client.set("replica_key", "value")
+        self.assertEqual(0, router.pools[0]._created_connections)
+
+        #the replica on port 1 refuses connections,reads fall back to the master
+        for i in range(5):
+            self.assertEqual("value", client.get("replica_key").data)
+        self.assertTrue(router.latencies[1] > router.latencies[0])
+        self.assertEqual(0, router.choose())
+
+        self.ssdb.delete("replica_key")
+        latencies = list(router.latencies)
+        with client.use_master():
+            self.assertEqual("not_found", client.get("replica_key").code)
+        self.assertEqual(latencies, router.latencies)
+        client.get("replica_key")
+        self.assertNotEqual(latencies, router.latencies)
+
+        #chunks of a split multi_get sent by worker threads stay on the master
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=2, chunk_keys=2, replicas=[('localhost', 8888)])
+        keys = ["replica_%d" % i for i in range(6)]
+        with client.use_master():
+            self.assertEqual([], client.multi_get(keys).data['index'])
+        self.assertEqual(0, client.replica_router.pools[0]._created_connections)
+        client.multi_get(keys)
+        self.assertNotEqual(0, client.replica_router.pools[0]._created_connections)
+
+    def test_hedger(self):
+        hedger = ssdb.RequestHedger(delay=0.01, workers=4)
+
+        def slow():
+            time.sleep(0.2)
+            return "slow"
+        self.assertEqual("fast", hedger.call(lambda: "fast", slow))
+        self.assertEqual("backup", hedger.call(slow, lambda: "backup"))
+        self.assertEqual({'requests': 2, 'fired': 1, 'won': 1, 'delay': 0.01}, hedger.stats())
+
+        def failing():
+            raise ssdb.ConnectionError("failed")
+        self.assertEqual("slow", hedger.call(slow, failing))
+        self.assertRaises(ssdb.ConnectionError, hedger.call, failing, slow)
+        hedger.close()
+        #counters are updated by many caller threads
+        hedger = ssdb.RequestHedger(delay=None, workers=8)
+        threads = [threading.Thread(target=lambda: [hedger.call(lambda: "fast", slow) for i in range(200)])
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1600, hedger.stats()['requests'])
+        hedger.close()
+
+        hedger = ssdb.RequestHedger(percentile=50, workers=2)
+        self.assertEqual(None, hedger.current_delay())
+        for i in range(ssdb.RequestHedger.min_samples):
+            hedger.record(i * 0.001)
+        self.assertEqual(0.01, hedger.current_delay())
+        hedger.close()
+
+    def test_hedged_reads(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=4, pool_timeout=1,
+                           hedger=ssdb.RequestHedger(delay=0))
+        client.set("hedge_key", "value")
+        for i in range(10):
+            self.assertEqual("value", client.get("hedge_key").data)
+        self.assertEqual(10, client.hedger.stats()['requests'])
+        self.assertEqual(["hedge_key"], client.multi_get(["hedge_key", "hedge_missing"]).data['index'])
+        client.delete("hedge_key")
+        client.hedger.close()
+
+    def test_range_iterators(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=2)
+        data = dict(("iter_%03d" % i, "value_%d" % i) for i in range(250))
+        client.multi_set(data)
+        client.multi_hset("iter_hash", data)
+        client.multi_zset("iter_zset", dict(("key_%03d" % i, i % 7) for i in range(250)))
+
+        r = list(client.scan_iterator("iter_", "iter_z", page_size=30))
+        self.assertEqual(sorted(data.items()), r)
+        r = list(client.rscan_iterator("iter_z", "iter_", page_bytes=100))
+        self.assertEqual(sorted(data.items(), reverse=True), r)
+        self.assertEqual(sorted(data), list(client.keys_iterator("iter_", "iter_z", prefetch=False)))
+        self.assertEqual(sorted(data.items()), list(client.hscan_iterator("iter_hash", page_size=7)))
+        self.assertEqual(sorted(data), list(client.hkeys_iterator("iter_hash", page_size=7)))
+        self.assertEqual(sorted(data.items(), reverse=True), list(client.hrscan_iterator("iter_hash")))
+        self.assertTrue("iter_hash" in list(client.hlist_iterator(page_size=1)))
+
+        expected = sorted((("key_%03d" % i, i % 7) for i in range(250)), key=lambda item: (item[1], item[0]))
+        self.assertEqual(expected, list(client.zscan_iterator("iter_zset", page_size=9)))
+        self.assertEqual([key for key, score in expected], list(client.zkeys_iterator("iter_zset", page_size=9)))
+        self.assertEqual(expected[::-1], list(client.zrscan_iterator("iter_zset", page_size=9)))
+        self.assertTrue("iter_zset" in list(client.zlist_iterator()))
+
+        #stopping early stops the prefetching thread
+        iterator = client.scan_iterator("iter_", "iter_z", page_size=10)
+        self.assertEqual(("iter_000", "value_0"), next(iterator))
+        iterator.close()
+
+        client.multi_del(data.keys())
+        client.multi_hdel("iter_hash", data.keys())
+        client.multi_zdel("iter_zset", ["key_%03d" % i for i in range(250)])
+
+    def test_parallel_scan(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=4)
+        data = dict(("pscan_%03d" % i, "value_%d" % i) for i in range(300))
+        client.multi_set(data)
+        client.multi_hset("pscan_hash", data)
+
+        r = list(client.parallel_scan("pscan_", "pscan_z", parts=4, ordered=True, page_size=20))
+        self.assertEqual(sorted(data.items()), r)
+        batches = list(client.parallel_scan("pscan_", "pscan_z", parts=4, page_size=20))
+        self.assertTrue(len(batches) > 4)
+        self.assertEqual(sorted(data.items()), sorted(item for batch in batches for item in batch))
+        r = list(client.parallel_scan("pscan_", "pscan_z", boundaries=["pscan_099", "pscan_100", "pscan_250"],
+                                      ordered=True, workers=2))
+        self.assertEqual(sorted(data.items()), r)
+        r = list(client.parallel_hscan("pscan_hash", parts=3, ordered=True, page_size=50))
+        self.assertEqual(sorted(data.items()), r)
+        self.assertEqual([], list(client.parallel_hscan("pscan_missing", parts=3)))
+
+        boundaries = ssdb.client._sample_boundaries(
+            lambda start: next((key for key in sorted(data) if key > start), None), "pscan_299", "pscan_", 4)
+        self.assertEqual(3, len(boundaries))
+
+        client.multi_del(data.keys())
+        client.multi_hdel("pscan_hash", data.keys())
+
+    def test_scan_result(self):
+        self.ssdb.multi_zset("result_zset", {"a": 3, "b": 1, "c": 2})
+        r = self.ssdb.zscan("result_zset", "", "", "", 10)
+        self.assertTrue(isinstance(r.data, ssdb.ScanResult))
+        self.assertEqual([("b", 1), ("c", 2), ("a", 3)], r.data.pairs())
+        self.assertEqual(["b", "c", "a"], r.data["index"])
+        self.assertEqual({"a": 3, "b": 1, "c": 2}, r.data["items"])
+        self.assertEqual({"index": ["b", "c", "a"], "items": {"a": 3, "b": 1, "c": 2}}, r.data)
+        #still usable as the dict it replaced
+        self.assertEqual(2, len(r.data))
+        self.assertEqual(dict(r.data.items()), dict(r.data.iteritems()))
+        self.assertEqual([["b", "c", "a"], {"a": 3, "b": 1, "c": 2}], [r.data[key] for key in sorted(r.data)])
+        self.assertEqual(r.data["items"], json.loads(json.dumps(dict(r.data)))["items"])
+        self.ssdb.multi_zdel("result_zset", ["a", "b", "c"])
+
+    def test_raw(self):
+        raw = ssdb.RawSSDB(self.ssdb)
+        self.assertEqual(1, raw.set("raw_key", "value"))
+        self.assertEqual("value", raw.get("raw_key"))
+        self.assertEqual(None, raw.get("raw_missing"))
+        self.assertEqual(["raw_key"], raw.multi_get(["raw_key", "raw_missing"])["index"])
+        self.assertEqual([("raw_key", "value")], list(raw.scan_iterator("raw_", "raw_z")))
+        try:
+            raw.incr("raw_key", 1)
+            self.fail("no error raised")
+        except ssdb.ResponseError, e:
+            self.assertNotEqual("ok", e.args[0])
+        raw.delete("raw_key")
+
+    def test_key_commands(self):
+        self.assertEqual(True, self.ssdb.setnx("cmd_key", "value").data)
+        self.assertEqual(False, self.ssdb.setnx("cmd_key", "other").data)
+        self.assertEqual("value", self.ssdb.getset("cmd_key", "new value").data)
+        self.assertEqual("not_found", self.ssdb.getset("cmd_missing", "value").code)
+        self.assertEqual(9, self.ssdb.strlen("cmd_key").data)
+        self.assertEqual(True, self.ssdb.exists("cmd_key").data)
+        self.assertEqual({"cmd_key": True, "cmd_other": False},
+                         self.ssdb.multi_exists(["cmd_key", "cmd_other"]).data)
+        self.assertEqual(-1, self.ssdb.ttl("cmd_key").data)
+        self.assertEqual(True, self.ssdb.expire("cmd_key", 100).data)
+        self.assertTrue(0 < self.ssdb.ttl("cmd_key").data <= 100)
+        self.assertEqual(False, self.ssdb.expire("cmd_other", 100).data)
+        self.ssdb.multi_del(["cmd_key", "cmd_missing"])
+        self.assertEqual(False, self.ssdb.exists("cmd_key").data)
+
+    def test_hash_commands(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, cache_max_bytes=1024 * 1024)
+        client.multi_hset("cmd_hash", {"a": "1", "b": "2"})
+        client.multi_zset("cmd_zset", {"a": 1, "b": 2})
+        self.assertEqual(True, client.hexists("cmd_hash", "a").data)
+        self.assertEqual(False, client.hexists("cmd_hash", "c").data)
+        r = client.hgetall("cmd_hash")
+        self.assertEqual({"a": "1", "b": "2"}, r.data["items"])
+        self.assertEqual("1", client.hget("cmd_hash", "a").data)
+        self.assertEqual(2, client.hclear("cmd_hash").data)
+        #clearing a hashmap drops its cached keys
+        self.assertEqual("not_found", client.hget("cmd_hash", "a").code)
+        self.assertEqual(2, client.zclear("cmd_zset").data)
+        self.assertEqual(0, client.zsize("cmd_zset").data)
+
+    def test_register_command(self):
+        ssdb.register_command("qfront", ssdb.client._parse_value, read=True)
+        try:
+            self.ssdb.request("qpush", ["cmd_queue", "a"])
+            self.assertEqual("a", self.ssdb.qfront("cmd_queue").data)
+        finally:
+            ssdb.unregister_command("qfront")
+            self.ssdb.request("qclear", ["cmd_queue"])
+        self.assertRaises(AttributeError, getattr, self.ssdb, "qfront")
+        self.assertRaises(AttributeError, getattr, self.ssdb, "no_such_cmd")
+        #only registered cmds become methods
+        self.assertRaises(AttributeError, getattr, self.ssdb, "setx")
+
+        #re-registering a known cmd keeps its read and cache settings unless given
+        ssdb.register_command("hget", ssdb.client._parse_value)
+        try:
+            self.assertTrue("hget" in ssdb.client.read_cmd)
+            ssdb.register_command("hdel", ssdb.client._parse_count)
+            self.assertTrue("hdel" in ssdb.client.cache_invalidations)
+        finally:
+            ssdb.unregister_command("hget")
+            ssdb.unregister_command("hdel")
+        self.assertEqual({}, ssdb.client.registered_cmds)
+        self.assertTrue("hget" in ssdb.client.response_parsers)
+
+    def test_zset_aggregation(self):
+        self.ssdb.multi_zset("agg_zset", {"a": 1, "b": 2, "c": 3, "d": 4, "e": 10})
+        self.assertEqual(4, self.ssdb.zcount("agg_zset", 1, 4).data)
+        self.assertEqual(5, self.ssdb.zcount("agg_zset", "", "").data)
+        self.assertEqual(9, self.ssdb.zsum("agg_zset", 2, 4).data)
+        self.assertEqual(3.0, self.ssdb.zavg("agg_zset", 2, 4).data)
+        self.assertEqual(1, self.ssdb.zrank("agg_zset", "b").data)
+        self.assertEqual(0, self.ssdb.zrrank("agg_zset", "e").data)
+        self.assertEqual("not_found", self.ssdb.zrank("agg_zset", "missing").code)
+
+        r = self.ssdb.zrange("agg_zset", 1, 2)
+        self.assertEqual([("b", 2), ("c", 3)], r.data.pairs())
+        r = self.ssdb.zrrange("agg_zset", 0, 2)
+        self.assertEqual(["e", "d"], r.data["index"])
+        self.assertEqual({"e": 10, "d": 4}, r.data["items"])
+
+        self.assertEqual(2, self.ssdb.zremrangebyscore("agg_zset", 3, 4).data)
+        self.assertEqual(1, self.ssdb.zremrangebyrank("agg_zset", 0, 0).data)
+        self.assertEqual(["b", "e"], self.ssdb.zrange("agg_zset", 0, 10).data["index"])
+        self.ssdb.zclear("agg_zset")
+
+    def test_queue(self):
+        self.assertEqual(3, self.ssdb.qpush_back("test_queue", ["b", "c", "d"]).data)
+        self.assertEqual(4, self.ssdb.qpush_front("test_queue", ["a"]).data)
+        self.assertEqual(4, self.ssdb.qsize("test_queue").data)
+        self.assertEqual(["a", "b", "c", "d"], self.ssdb.qslice("test_queue", 0, -1).data)
+        self.assertEqual(["a", "b"], self.ssdb.qpop_front("test_queue", 2).data)
+        self.assertEqual(["d"], self.ssdb.qpop_back("test_queue").data)
+        self.assertEqual(1, self.ssdb.qclear("test_queue").data)
+        self.assertEqual(0, self.ssdb.qsize("test_queue").data)
+
+    def test_queue_producer_consumer(self):
+        items = ["item_%d" % i for i in range(1000)]
+        with self.ssdb.queue_producer("test_queue", batch_size=100) as producer:
+            for item in items[:950]:
+                producer.put(item)
+            self.assertEqual(900, self.ssdb.qsize("test_queue").data)
+        self.assertEqual(950, self.ssdb.qsize("test_queue").data)
+        for item in items[950:]:
+            producer.put(item)
+        producer.flush()
+
+        consumer = self.ssdb.queue_consumer("test_queue", batch_size=64, prefetch=3)
+        self.assertEqual(items[:500], [next(consumer) for i in range(500)])
+        consumer.close()
+        #popped but unconsumed items are back at the front
+        self.assertEqual(items[500:], self.ssdb.qslice("test_queue", 0, -1).data)
+
+        with self.ssdb.queue_consumer("test_queue", batch_size=64) as consumer:
+            self.assertEqual(items[500:], list(consumer))
+        self.assertEqual(0, self.ssdb.qsize("test_queue").data)
+
+    def test_bulk_loader(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=3)
+        reports = []
+        loader = ssdb.BulkLoader(client, chunk_bytes=1000, in_flight=3, progress=reports.append)
+        stats = loader.load(("bulk_%04d" % i, "value_%d" % i) for i in xrange(2000))
+        self.assertEqual(2000, stats['items'])
+        self.assertTrue(stats['chunks'] > 10)
+        self.assertEqual(stats, reports[-1])
+        self.assertEqual("value_1234", client.get("bulk_1234").data)
+
+        stats = loader.load_hash(("bulk_hash_%d" % (i // 500), "key_%d" % i, i) for i in xrange(2000))
+        self.assertEqual(2000, stats['items'])
+        self.assertEqual(500, client.hsize("bulk_hash_3").data)
+        loader.load_zset(("bulk_zset", "key_%d" % i, i) for i in xrange(300))
+        self.assertEqual(299, client.zget("bulk_zset", "key_299").data)
+
+        self.assertRaises(ssdb.ResponseError, loader.load_zset, [("bulk_zset", "key", "not a score")])
+
+        client.multi_del(["bulk_%04d" % i for i in xrange(2000)])
+        for i in range(4):
+            client.hclear("bulk_hash_%d" % i)
+        client.zclear("bulk_zset")
+
+    def test_dump_restore(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=2)
+        data = dict(("dump_%03d" % i, "value_%d" % i * (i % 5)) for i in range(200))
+        client.multi_set(data)
+        client.multi_hset("dump_hash", dict(("key_%d" % i, "value_%d" % i) for i in range(100)))
+        client.multi_zset("dump_zset", dict(("key_%d" % i, i - 50) for i in range(100)))
+        path = os.path.join(tempfile.mkdtemp(), "dump")
+        try:
+            blocks = []
+            stats = ssdb.dump(client, path, "dump_", "dump_zz", block_bytes=500, progress=blocks.append)
+            self.assertEqual(400, stats['records'])
+            self.assertTrue(stats['blocks'] > 3)
+            self.assertEqual(stats, blocks[-1])
+            records = list(ssdb.snapshot.read_records(path))
+            self.assertEqual(400, len(records))
+            self.assertEqual(("k", None, "dump_000", ""), records[0])
+            self.assertTrue(("z", "dump_zset", "key_0", -50) in records)
+
+            #a dump cut in the middle of a block resumes after its last complete block
+            size = os.path.getsize(path)
+            with open(path, 'r+b') as f:
+                f.truncate(size * 2 // 3)
+            stats = ssdb.dump(client, path, "dump_", "dump_zz", block_bytes=500, resume=True)
+            self.assertEqual(400, stats['records'])
+            self.assertEqual(records, list(ssdb.snapshot.read_records(path)))
+            tail = list(ssdb.snapshot.read_records(path, 3))
+            self.assertEqual(records[-len(tail):], tail)
+
+            client.multi_del(data.keys())
+            client.hclear("dump_hash")
+            client.zclear("dump_zset")
+            blocks = stats['blocks']
+            stats = ssdb.restore(client, path, start_block=2)
+            self.assertEqual(blocks, stats['blocks'])
+            self.assertEqual(len(list(ssdb.snapshot.read_records(path, 2))), stats['records'])
+            self.assertEqual("not_found", client.get("dump_000").code)
+            stats = ssdb.restore(client, path)
+            self.assertEqual(400, stats['records'])
+            self.assertEqual(sorted(data.items()), list(client.scan_iterator("dump_", "dump_z")))
+            self.assertEqual(100, client.hsize("dump_hash").data)
+            self.assertEqual(-50, client.zget("dump_zset", "key_0").data)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+            client.multi_del(data.keys())
+            client.hclear("dump_hash")
+            client.zclear("dump_zset")
+
+    def test_chunked_multi(self):
+        data = dict(("chunk_%03d" % i, "value_%d" % i) for i in range(100))
+        keys = sorted(data, reverse=True)[:60] + ["chunk_missing"] + sorted(data)[:40]
+        for client in (ssdb.SSDB('127.0.0.1', 8888, chunk_keys=7),
+                       ssdb.SSDB('127.0.0.1', 8888, max_connections=3, chunk_keys=7, chunk_bytes=50),
+                       ssdb.SSDB('127.0.0.1', 8888, max_connections=3, pool_timeout=5, chunk_keys=7),
+                       ssdb.SSDB('127.0.0.1', 8888, multiplex=True, chunk_keys=7)):
+            self.assertEqual(100, client.multi_set(data).data)
+            r = client.multi_get(keys)
+            self.assertEqual([key for key in keys if key in data], r.data['index'])
+            self.assertEqual(data, r.data['items'])
+            self.assertEqual({"chunk_000": True, "chunk_missing": False},
+                             dict((key, exists) for key, exists in client.multi_exists(keys).data.items()
+                                  if key in ("chunk_000", "chunk_missing")))
+
+            self.assertEqual(100, client.multi_hset("chunk_hash", data).data)
+            self.assertEqual(data, client.multi_hget("chunk_hash", keys).data['items'])
+            self.assertEqual(101, client.multi_zset("chunk_zset", dict((key, i) for i, key in enumerate(keys))).data)
+            r = client.multi_zget("chunk_zset", keys)
+            self.assertEqual(keys, r.data['index'])
+            self.assertEqual(range(len(keys)), [r.data['items'][key] for key in keys])
+
+            self.assertEqual(100, client.multi_del(data.keys()).data)
+            self.assertEqual(100, client.multi_hdel("chunk_hash", data.keys()).data)
+            self.assertEqual(101, client.multi_zdel("chunk_zset", keys).data)
+            self.assertEqual([], client.multi_get(keys).data["index"])
+
+    def test_chunked_multi_threads(self):
+        #chunks of threads sharing a pool that can't wait don't take each other's connections
+        data = dict(("chunk_t_%04d" % i, "v") for i in range(2000))
+        self.ssdb.multi_set(data)
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=4, chunk_keys=100)
+        results = []
+
+        def read():
+            try:
+                results.append(len(client.multi_get(data.keys()).data['index']))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([2000] * 4, results)
+        self.assertTrue(client.connection_pool._created_connections <= 4)
+        self.ssdb.multi_del(data.keys())
+
+
+    def test_codecs(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, codec=ssdb.CompressedCodec(ssdb.JSONCodec(), threshold=100))
+        big = {"items": ["item"] * 1000}
+        self.assertTrue(client.set("codec_small", [1, "a"]).ok())
+        self.assertTrue(client.set("codec_big", big).ok())
+        self.assertEqual([1, "a"], client.get("codec_small").data)
+        self.assertEqual(big, client.get("codec_big").data)
+        raw = self.ssdb.get("codec_big").data
+        self.assertEqual(ssdb.CompressedCodec.COMPRESSED, raw[0])
+        self.assertTrue(len(raw) < 100)
+        self.assertEqual('\x00[1,"a"]', self.ssdb.get("codec_small").data)
+        self.assertTrue(client.get("codec_missing").not_found())
+
+        self.assertEqual(2, client.multi_set({"codec_a": {"a": 1}, "codec_b": None}).data)
+        self.assertEqual({"codec_a": {"a": 1}, "codec_b": None},
+                         client.multi_get(["codec_a", "codec_b"]).data["items"])
+        r = client.scan("codec_", "codec_z", 10)
+        self.assertEqual(["codec_a", "codec_b", "codec_big", "codec_small"], r.data["index"])
+        self.assertEqual(big, r.data["items"]["codec_big"])
+        self.assertEqual(4, len(list(client.scan_iterator("codec_", "codec_z"))))
+
+        self.assertTrue(client.hset("codec_hash", "key", 1.5).ok())
+        self.assertEqual(1.5, client.hget("codec_hash", "key").data)
+        self.assertEqual({"key": 1.5}, client.hgetall("codec_hash").data["items"])
+        self.assertEqual(2, client.qpush_back("codec_queue", [{"a": 1}, [2]]).data)
+        self.assertEqual([{"a": 1}, [2]], client.qpop_front("codec_queue", 2).data)
+        self.assertRaises(ValueError, ssdb.CompressedCodec().decode, "no marker")
+
+        packed = ssdb.SSDB('127.0.0.1', 8888, codec=ssdb.StructCodec('<q'))
+        self.assertTrue(packed.set("codec_int", -5).ok())
+        self.assertEqual(8, len(self.ssdb.get("codec_int").data))
+        self.assertEqual(-5, packed.get("codec_int").data)
+        self.assertEqual({"x": [1]}, ssdb.PickleCodec().decode(ssdb.PickleCodec().encode({"x": [1]})))
+
+        #pipelines and async methods use the codec too
+        with client.pipeline(max_commands=2) as pipe:
+            pipe.set("codec_a", {"pipe": 1}).hset("codec_hash", "key", [2]).get("codec_a").get("codec_missing")
+            responses = pipe.execute()
+        self.assertEqual([{"pipe": 1}, "not_found"], [responses[2].data, responses[3].code])
+        self.assertEqual([2], client.hget("codec_hash", "key").data)
+        multiplexed = ssdb.SSDB('127.0.0.1', 8888, multiplex=True, codec=client.codec)
+        self.assertTrue(multiplexed.set_async("codec_b", {"async": True}).result(1).ok())
+        self.assertEqual({"async": True}, client.get("codec_b").data)
+        self.assertEqual({"async": True}, multiplexed.get_async("codec_b").result(1).data)
+        multiplexed.multiplexer.close()
+
+        self.ssdb.multi_del(["codec_small", "codec_big", "codec_a", "codec_b", "codec_int"])
+        self.ssdb.hclear("codec_hash")
+
+    def test_columns(self):
+        scores = dict(("col_%03d" % i, i * 1000000007 - 50) for i in range(50))
+        self.assertEqual(50, self.ssdb.multi_zset("col_zset", scores).data)
+        self.assertEqual(50, self.ssdb.multi_set(dict((key, str(score * 0.5)) for key, score in scores.items())).data)
+        try:
+            keys, values = self.ssdb.zscan("col_zset", "", "", "", 100).data.columns(use_numpy=False)
+            self.assertEqual(sorted(scores, key=scores.get), keys)
+            self.assertEqual([scores[key] for key in keys], list(values))
+            self.assertEqual(8, values.itemsize)
+            keys, values = self.ssdb.zrscan("col_zset", "", "", "", 100).data.columns(use_numpy=False)
+            self.assertEqual(sorted(scores, key=scores.get, reverse=True), keys)
+            keys, values = self.ssdb.multi_zget("col_zset", ["col_001", "col_missing", "col_000"]).data.columns(
+                use_numpy=False)
+            self.assertEqual(["col_001", "col_000"], keys)
+            self.assertEqual([scores["col_001"], scores["col_000"]], list(values))
+            keys, values = self.ssdb.multi_get(["col_003", "col_004"]).data.columns('d', use_numpy=False)
+            self.assertEqual(["col_003", "col_004"], keys)
+            self.assertEqual([scores["col_003"] * 0.5, scores["col_004"] * 0.5], list(values))
+            keys, values = self.ssdb.multi_zget("col_zset", ["col_000", "col_001"]).data.columns('l', use_numpy=False)
+            self.assertEqual([scores["col_000"], scores["col_001"]], list(values))
+            keys, values = self.ssdb.multi_zget("col_zset", ["col_000"]).data.columns('i', use_numpy=False)
+            self.assertEqual([-50], list(values))
+            keys, values = self.ssdb.multi_get(["col_missing"]).data.columns(use_numpy=False)
+            self.assertEqual(([], []), (keys, list(values)))
+            if ssdb.client.numpy is not None:
+                keys, values = self.ssdb.zscan("col_zset", "", "", "", 100).data.columns()
+                self.assertEqual([scores[key] for key in keys], values.tolist())
+        finally:
+            self.ssdb.zclear("col_zset")
+            self.ssdb.multi_del(scores.keys())
+
+    def test_metrics(self):
+        metrics = ssdb.ClientMetrics()
+        calls = []
+        before = lambda cmd, params: calls.append(('before', cmd))
+        after = lambda cmd, params, resp, seconds, error: calls.append(('after', cmd, type(error), seconds >= 0))
+        metrics.add_hook(before, after)
+        client = ssdb.SSDB('127.0.0.1', 8888, max_connections=2, metrics=metrics)
+        self.assertTrue(client.set("metrics_key", "value").ok())
+        self.assertEqual("value", client.get("metrics_key").data)
+        self.assertTrue(client.get("metrics_missing").not_found())
+        self.assertRaises(ssdb.ConnectionError, ssdb.SSDB('127.0.0.1', 1, metrics=metrics).get, "metrics_key")
+        self.assertEqual([('before', 'set'), ('after', 'set', type(None), True),
+                          ('before', 'get'), ('after', 'get', type(None), True)], calls[:4])
+        self.assertEqual(('after', 'get', ssdb.ConnectionError, True), calls[-1])
+
+        snapshot = metrics.snapshot()
+        get = snapshot['commands']['get']
+        self.assertEqual(3, get['latency']['count'])
+        self.assertTrue(get['latency']['p99'] <= get['latency']['max'])
+        self.assertEqual(3, sum(count for bound, count in get['latency']['buckets']))
+        self.assertEqual(len("3\nget\n11\nmetrics_key\n\n") + len("3\nget\n15\nmetrics_missing\n\n"),
+                         get['request_bytes'])
+        self.assertEqual(len("2\nok\n5\nvalue\n\n") + len("9\nnot_found\n\n"), get['response_bytes'])
+        self.assertEqual({'ConnectionError': 1}, get['errors'])
+        self.assertEqual(3, get['calls'])
+        self.assertEqual(3, snapshot['pool_wait']['count'])
+        pool = snapshot['pools']['127.0.0.1:8888']
+        self.assertEqual((2, 1, 0, 1, 1), (pool['max_connections'], pool['connections'], pool['in_use'],
+                                           pool['available'], pool['peak_in_use']))
+
+        metrics.remove_hook(before, after)
+        metrics.reset()
+        self.assertTrue(client.delete("metrics_key").ok())
+        self.assertEqual(['del'], metrics.snapshot()['commands'].keys())
+        self.assertEqual(8, len(calls))
+
+    def test_memoryview_threshold(self):
+        client = ssdb.SSDB('127.0.0.1', 8888, memoryview_threshold=4)
+        client.multi_set({"mv_a": "value a", "mv_b": "value b"})
+        try:
+            r = client.get("mv_missing")
+            self.assertEqual("not_found", r.code)
+            self.assertTrue(r.not_found())
+            self.assertEqual("value a", client.get("mv_a").data.tobytes())
+            r = client.scan("mv_", "mv_z", 10)
+            self.assertEqual(["mv_a", "mv_b"], r.data["index"])
+            self.assertEqual(["mv_a", "mv_b"], sorted(r.data["items"]))
+            self.assertEqual("value b", r.data["items"]["mv_b"].tobytes())
+            self.assertEqual(["mv_a", "mv_b"], client.keys("mv_", "mv_z", 10).data)
+        finally:
+            client.multi_del(["mv_a", "mv_b"])
 
 if __name__ == '__main__':
     unittest.main()
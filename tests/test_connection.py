@@ -1,5 +1,9 @@
-from ssdb.client import ConnectionPool, Connection, ConnectionError
+from ssdb.client import ConnectionPool, Connection, ConnectionError, ResponseParser, SSDB, encode_cmd
+import ssdb.client
 from unittest import TestCase
+import socket
+import threading
+import time
 import unittest
 
 
@@ -36,6 +40,147 @@ class ConnectionTest(TestCase):
 
         self.assertEqual(c1, c2)
 
+    def test_wait_for_connection(self):
+        pool = ConnectionPool(max_connections=1, timeout=1)
+
+        c1 = pool.get_connection()
+        timer = threading.Timer(0.05, pool.release, [c1])
+        timer.start()
+        c2 = pool.get_connection()
+        timer.join()
+        self.assertEqual(c1, c2)
+
+        pool.timeout = 0.05
+        start = time.time()
+        self.assertRaises(ConnectionError, pool.get_connection)
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_lifo_reuse(self):
+        pool = self.get_pool(2)
+
+        c1 = pool.get_connection()
+        c2 = pool.get_connection()
+        pool.release(c1)
+        pool.release(c2)
+
+        self.assertEqual(c2, pool.get_connection())
+
+    def test_discard_broken_connection(self):
+        pool = self.get_pool()
+
+        c1 = pool.get_connection()
+        c1.dis_connect()
+        pool.release(c1)
+        self.assertEqual(0, pool._created_connections)
+
+        c2 = pool.get_connection()
+        c2.parser.feed("2\nok\n")
+        pool.release(c2)
+        self.assertEqual(0, pool._created_connections)
+
+        c3 = pool.get_connection()
+        self.assertTrue(c3 is not c1 and c3 is not c2)
+
+    def test_reap_idle_connection(self):
+        pool = ConnectionPool(max_connections=2, idle_timeout=0)
+
+        c1 = pool.get_connection()
+        pool.release(c1)
+        c2 = pool.get_connection()
+
+        self.assertTrue(c1 is not c2)
+        self.assertEqual(None, c1.socket)
+        self.assertEqual(1, pool._created_connections)
+
+    def test_check_on_checkout(self):
+        pool = ConnectionPool(max_connections=1, check_on_checkout=True)
+
+        c1 = pool.get_connection()
+        pool.release(c1)
+        self.assertEqual(c1, pool.get_connection())
+
+
+class ParserTest(TestCase):
+    def get_connection(self, memoryview_threshold=None):
+        connection = Connection(memoryview_threshold=memoryview_threshold)
+        connection.socket, self.server = socket.socketpair()
+        return connection
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_parse_partial_response(self):
+        connection = self.get_connection()
+
+        self.server.sendall("2\nok\n5\nva")
+        connection._read_response()
+        self.assertEqual(None, connection.parse())
+
+        self.server.sendall("lue\n\n2\nok\n\n")
+        self.assertEqual(['ok', 'value'], connection.read_response())
+        self.assertEqual(['ok'], connection.read_response())
+
+    def test_parse_large_value(self):
+        connection = self.get_connection()
+        value = 'x' * (ResponseParser.buffer_size * 3 + 7)
+
+        self.server.sendall("2\nok\n%d\n%s\n\n" % (len(value), value))
+        self.assertEqual(['ok', value], connection.read_response())
+
+    def test_parse_memoryview(self):
+        connection = self.get_connection(memoryview_threshold=4)
+
+        self.server.sendall("2\nok\n5\nvalue\n\n2\nok\n3\nval\n\n")
+        resp = connection.read_response()
+        self.assertTrue(isinstance(resp[1], memoryview))
+        self.assertEqual('value', resp[1].tobytes())
+
+        resp = connection.read_response()
+        self.assertEqual(['ok', 'val'], resp)
+
+    def test_closed_by_server(self):
+        connection = self.get_connection()
+
+        self.server.sendall("2\nok\n")
+        self.server.close()
+        self.assertRaises(ConnectionError, connection.read_response)
+
+
+class ResponseParserTest(TestCase):
+    def test_parser_feed(self):
+        parser = ResponseParser()
+
+        parser.feed("2\nok\n1\n")
+        self.assertEqual(None, parser.gets())
+        parser.feed("a\n\n9\nnot_found\n\n")
+        self.assertEqual(['ok', 'a'], parser.gets())
+        self.assertEqual(['not_found'], parser.gets())
+        self.assertEqual(None, parser.gets())
+
+        view = parser.get_buffer(4)
+        view[:4] = "2\nok"
+        del view
+        parser.buffer_updated(4)
+        parser.feed("\n\n")
+        self.assertEqual(['ok'], parser.gets())
+
+
+class EncodeTest(TestCase):
+    def test_encode_cmd(self):
+        params = ['key', 1, u'value', 1.5]
+        chunks = encode_cmd('set', params)
+
+        self.assertEqual(1, len(chunks))
+        self.assertEqual(SSDB().generate_cmd(['set'] + params), chunks[0])
+
+    def test_encode_large_value(self):
+        value = 'x' * ssdb.client.send_join_threshold
+        chunks = encode_cmd('set', ['key', value])
+
+        self.assertEqual(3, len(chunks))
+        self.assertTrue(chunks[1] is value)
+        self.assertEqual(SSDB().generate_cmd(['set', 'key', value]), ''.join(chunks))
+
 
 if __name__ == '__main__':
     unittest.main()